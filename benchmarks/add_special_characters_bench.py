@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# add_special_characters benchmark:
+# compares the insertion buffer against the original slicing
+# implementation for growing input lengths.
+
+import sys
+import time
+
+import pw.transform as pt
+
+def add_special_characters_slicing(s, min_count, max_count, special_chars):
+    """the original implementation, rebuilds and rehashes s on every insertion"""
+    s = pt.to_string(s)
+
+    if max_count < min_count or max_count < 0:
+        return s
+
+    ls = len(s)
+    num_chars = min(pt.seed(s, min_count, max_count), ls)
+
+    if num_chars == 0:
+        return s
+
+    lsc = len(special_chars)-1
+    dst = ls // num_chars
+    pos = 0
+
+    for i in range(0, num_chars):
+        tmp = s + str(i)
+        hsh = pt.sha256(tmp)
+        schar = special_chars[pt.seed(hsh, 0, lsc)]
+        ipos = pt.seed(tmp, pos, pos + dst)
+        s = s[:ipos] + schar + s[ipos:]
+        pos += dst + 1
+
+    return s
+
+def measure(f, *args):
+    start = time.perf_counter()
+    ret = f(*args)
+    return time.perf_counter() - start, ret
+
+def run_benchmark(lengths):
+    words = pt.diceware("benchmark", 4, 4) + " "
+
+    print("%10s %10s %12s %12s %8s" % ("length", "inserts", "slicing [s]", "buffer [s]", "speedup"))
+
+    for length in lengths:
+        s = (words * (length // len(words) + 1))[:length]
+        count = length // 4
+
+        # same count for both, don't let the first run warm the cache for the second
+        pt.seed_cache.clear()
+        t1, expected = measure(add_special_characters_slicing, s, count, count, "#+*%&[]=?_.:")
+        pt.seed_cache.clear()
+        t2, actual = measure(pt.add_special_characters, s, count, count, "#+*%&[]=?_.:")
+
+        if expected != actual:
+            raise AssertionError("outputs differ for length %d" % length)
+
+        print("%10d %10d %12.4f %12.4f %7.2fx" % (length, count, t1, t2, t1 / t2))
+
+if __name__ == "__main__":
+    lengths = [int(x) for x in sys.argv[1:]] or [250, 1000, 4000, 16000]
+    run_benchmark(lengths)
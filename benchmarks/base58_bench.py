@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# base58 benchmark:
+# compares pw.b58 against the base58 package, if it is installed.
+
+import os
+import sys
+import timeit
+
+import pw.b58
+
+def run_benchmark(sizes):
+    try:
+        import base58
+    except ImportError:
+        base58 = None
+        print("base58 package not installed, only timing pw.b58")
+
+    print("%8s %14s %14s %8s" % ("bytes", "base58 [us]", "pw.b58 [us]", "speedup"))
+
+    for size in sizes:
+        data = os.urandom(size)
+        number = max(10, 20000 // size)
+
+        t2 = timeit.timeit(lambda: pw.b58.b58encode(data), number=number) / number * 1e6
+
+        if not base58:
+            print("%8d %14s %14.1f %8s" % (size, "-", t2, "-"))
+            continue
+
+        if base58.b58encode(data) != pw.b58.b58encode(data):
+            raise AssertionError("outputs differ for %d bytes" % size)
+
+        t1 = timeit.timeit(lambda: base58.b58encode(data), number=number) / number * 1e6
+        print("%8d %14.1f %14.1f %7.2fx" % (size, t1, t2, t1 / t2))
+
+if __name__ == "__main__":
+    sizes = [int(x) for x in sys.argv[1:]] or [32, 64, 256, 1024, 4096, 8192]
+    run_benchmark(sizes)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# pwlist4 benchmark:
+# parses synthetic pwlist4 files with the given numbers of user entries,
+# spread over domains with 1 to 3 users each. to compare against another
+# version of the parser, pass its pwlist.py with --baseline, e.g.
+#   git show <commit>:pw/pwlist.py > /tmp/pwlist_old.py
+#   python3 benchmarks/pwlist4_bench.py --baseline /tmp/pwlist_old.py
+
+import argparse
+import importlib.util
+import os
+import random
+import string
+import tempfile
+import time
+
+import pw.pwlist
+
+def make_pwlist4(entries, seed = 0):
+    rng = random.Random(seed)
+    parts = ["# synthetic pwlist4 file\n\n[+good_password]\n    init($key, $domain, $user)\n    diceware(4, 4)\n    capitalize_some()\n\n"]
+    n = 0
+
+    while n < entries:
+        parts.append("".join(rng.choice(string.ascii_lowercase) for i in range(rng.randint(4, 12))) + "%d.com:\n" % n)
+
+        for i in range(min(rng.randint(1, 3), entries - n)):
+            parts.append("    user%d@mail.com - good_password\n" % rng.randrange(10**6))
+            n += 1
+
+        parts.append("\n")
+
+    return "".join(parts)
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location("pwlist_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def best_time(f, repeat):
+    ret = None
+
+    for i in range(repeat):
+        t = time.perf_counter()
+        f()
+        t = time.perf_counter() - t
+        ret = t if ret is None else min(ret, t)
+
+    return ret
+
+def domain_summary(pws):
+    return [(d.name, [(u.name, u.sequence) for u in d.users.values()]) for d in pws.domains.values()]
+
+def run_benchmark(sizes, baseline, repeat):
+    print("%9s %9s %14s %14s %8s" % ("entries", "MB", "pw.pwlist [s]", "baseline [s]", "speedup"))
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+
+        for size in sizes:
+            with open(path, "w") as f:
+                f.write(make_pwlist4(size))
+
+            mb = os.path.getsize(path) / 1e6
+            t2 = best_time(lambda: pw.pwlist.load_pwlist4(path), repeat)
+
+            if not baseline:
+                print("%9d %9.1f %14.3f %14s %8s" % (size, mb, t2, "-", "-"))
+                continue
+
+            if domain_summary(baseline.load_pwlist4(path)) != domain_summary(pw.pwlist.load_pwlist4(path)):
+                raise AssertionError("results differ for %d entries" % size)
+
+            t1 = best_time(lambda: baseline.load_pwlist4(path), repeat)
+            print("%9d %9.1f %14.3f %14.3f %7.2fx" % (size, mb, t2, t1, t1 / t2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", help="pwlist.py of the parser to compare against", default=None)
+    parser.add_argument("--repeat", help="runs per size, the best is shown", type=int, default=3)
+    parser.add_argument("sizes", help="numbers of user entries", type=int, nargs="*")
+    args = parser.parse_args()
+
+    run_benchmark(args.sizes or [10000, 100000, 1000000], args.baseline and load_module(args.baseline), args.repeat)
@@ -4,67 +4,176 @@
 
 import sys
 import os
-import getpass
 import copy
 
 import argparse
-import clipboard
 
-# local imports
-from pw.sequence import execute_sequence
-from pw.transform import *
-from pw.pwlist import *
+# local imports. everything else is imported by the commands that need
+# it, so e.g. -l with an up to date completion index doesn't have to
+# load the pwlist file, the transformations or the clipboard
+from pw.paths import pwlist2_legacy_path, pwlist4_cache_path, pwlist4_path
 from pw.util import *
 import pw.config
 
 pws = None # the loaded domain / user / sequence db
 fp = "" # the filepath to use to store / load from
+out = sys.stdout # where --batch results are written
 
-def complete(args):
-    if not args.domain:
-        for domain in pws.domains.keys():
-            print(domain)
-    
+def print_names(path, index, args):
+    if args.fuzzy is None:
+        names = index.complete(args.domain, args.prefix, args.limit)
     else:
-        domain = pws.domains.get(args.domain)
-        for user in domain.users.keys():
-            print(user)
+        from pw.fuzzy import fuzzy_index
+        
+        limit = 10 if args.limit is None else args.limit
+        fuzzy = fuzzy_index(path, index)
+        
+        if args.domain:
+            names = fuzzy.suggest_users(args.domain, args.fuzzy, limit)
+        else:
+            names = fuzzy.suggest_domains(args.fuzzy, limit)
+    
+    for name in names:
+        print(name)
     
     return 0
 
 
+def complete_from_index(args):
+    """lists names using the completion index of the pwlist file, returns
+    None if the index has to be rebuilt"""
+    from pw.completion import load_index
+    
+    path = args.file or pwlist4_path()
+    index = load_index(path)
+    
+    if not index:
+        return None
+    
+    return print_names(path, index, args)
+
+
+def complete(args):
+    from pw.completion import update_index
+    
+    vprintf("updating completion index of '%s'", fp)
+    return print_names(fp, update_index(fp, pws), args)
+
+
+def load_known_user(args):
+    """loads only the domain of args and the sequences if the pwlist file
+    was saved sorted and generating the password doesn't change it, i.e.
+    the user is known and keeps its sequence. returns None otherwise.
+    new users could be saved to the journal, but e.g. did_you_mean needs
+    all domains."""
+    from pw.pwlist import load_pwlist4_domain
+    
+    part = load_pwlist4_domain(args.file or pwlist4_path(), args.domain)
+    
+    if not part:
+        return None
+    
+    usr = part.get_user(args.domain, args.user)
+    
+    if not usr:
+        return None
+    
+    seq = part.get_sequence(args.sequence or usr.sequence)
+    
+    if not seq or seq.name != usr.sequence:
+        return None
+    
+    return part
+
+
+def did_you_mean(args):
+    """offers similar known names if the domain or user is new, because a
+    typo silently generates a different password"""
+    from pw.completion import load_index, update_index
+    from pw.fuzzy import SUGGEST_SIMILARITY, fuzzy_index
+    
+    if not args.domain or not pws.domains:
+        return
+    
+    fuzzy = None
+    
+    for kind in ["domain", "user"]:
+        domain = pws.domains.get(args.domain)
+        
+        if kind == "domain" and domain:
+            continue
+        
+        if kind == "user" and (not domain or not args.user or args.user in domain.users):
+            return
+        
+        if not fuzzy:
+            fuzzy = fuzzy_index(fp, load_index(fp) or update_index(fp, pws))
+        
+        if kind == "domain":
+            name = args.domain
+            suggestions = fuzzy.suggest_domains(name, 3, SUGGEST_SIMILARITY)
+        else:
+            name = args.user
+            suggestions = fuzzy.suggest_users(args.domain, name, 3, SUGGEST_SIMILARITY)
+        
+        if not suggestions:
+            continue
+        
+        if not sys.stdin.isatty():
+            warn("%s '%s' not found, did you mean %s?", kind, name, " or ".join("'%s'" % x for x in suggestions))
+            continue
+        
+        a = prompt("%s '%s' not found, did you mean '%s'?" % (kind, name, suggestions[0]), default=1)
+        
+        if a == 'y':
+            setattr(args, kind, suggestions[0])
+
+
 def show_transformations():
+    from pw.transform import transformations
+    
     for t in transformations.values():
         print(t.get_doc(), "\n")
 
 
 def load_pws_from_default_paths():
-    """searches the default paths for pwlist files"""
+    """searches the default paths for pwlist files, returns the error
+    message of validate_pwfile"""
+    from pw.pwcache import load_validated
+    from pw.pwlist import Pwfile, load_pwlist2, load_pwlist4, save_pwlist4, validate_pwfile
+    
     global pws
     global fp
     
-    pws = load_pwlist4(pwlist4_path)
-    fp = pwlist4_path
+    fp = pwlist4_path()
+    pws, er = load_validated(fp, load_pwlist4, pwlist4_cache_path())
     
     if not pws:
-        vprintf("nothing found, trying to load legacy file '%s'", pwlist2_legacy_path)
-        pws = load_pwlist2(pwlist2_legacy_path)
+        legacy_path = pwlist2_legacy_path()
+        vprintf("nothing found, trying to load legacy file '%s'", legacy_path)
+        pws = load_pwlist2(legacy_path)
         
         if pws:
             c = prompt("legacy pwlist2 found but no pwlist4, convert?", default=0)
             
             if c == "y":
-                save_pwlist4(pwlist4_path, pws)
-                pws = load_pwlist4(pwlist4_path)
+                save_pwlist4(fp, pws)
+                pws = load_pwlist4(fp)
         else:
             vprintf("nothing found, creating empty pwlist4 file")
             pws = Pwfile()
-            save_pwlist4(pwlist4_path, pws)
-            pws = load_pwlist4(pwlist4_path)
-            
+            save_pwlist4(fp, pws)
+            pws = load_pwlist4(fp)
+        
+        er = validate_pwfile(pws)
+    
+    return er
+
 
 def import_pwfile4(path, force=False):
     """import domains, users and sequences from a given path"""
+    from pw.pwlist import Domain, User, load_pwlist, save_pwlist4, validate_pwfile
+    
     global pws
     global fp
     
@@ -190,13 +299,7 @@ def get_sequence_name(args):
         vprintf("using default sequence")
         return "DEFAULT"
     
-    domain = pws.domains.get(args.domain)
-    
-    if not domain:
-        vprintf("using default sequence")
-        return "DEFAULT"
-    
-    usr = domain.users.get(args.user)
+    usr = pws.get_user(args.domain, args.user)
     
     if not usr:
         vprintf("using default sequence")
@@ -208,25 +311,122 @@ def get_sequence_name(args):
 
 
 def add_user(domain, user, seqname):
-    """adds or modifies a user in the pwfile"""
-    global pws
+    """adds or modifies a user in the pwfile, returns whether it changed.
+    users with names the pwlist4 parser refuses aren't added."""
+    from pw.pwlist import check_forbidden_symbol_in_name
+    
+    try:
+        check_forbidden_symbol_in_name(domain)
+        check_forbidden_symbol_in_name(user)
+    except ValueError as e:
+        warn("not saving user '%s' of domain '%s': %s", user, domain, e)
+        return False
+    
+    return pws.add_user(domain, user, seqname)
+
+
+def read_key():
+    """prompts for the encryption key, returns None if aborted"""
+    import getpass
+    
+    try:
+        return getpass.getpass("Encryption key: ")
+    except EOFError:
+        print("\naborted")
+    except KeyboardInterrupt:
+        print("\naborted")
     
-    dom = pws.domains.get(domain)
+    return None
+
+
+def batch_record(line, key, default_sequence):
+    """generates the password of one json record, returns the result record"""
+    import json
+    from pw.pwlist import check_forbidden_symbol_in_name
+    from pw.sequence import execute_sequence
     
-    if not dom:
-        vprintf("adding new domain %s", domain)
-        pws.domains[domain] = Domain(domain)
-        dom = pws.domains[domain]
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return {"error": "invalid json: %s" % e}
     
-    usr = dom.users.get(user)
+    if not isinstance(record, dict):
+        return {"error": "expected an object"}
     
-    if not usr:
-        vprintf("adding new user %s to domain %s", user, domain)
-        dom.users[user] = User(user)
-        usr = dom.users[user]
+    domain = record.get("domain") or ""
+    user = record.get("user") or ""
+    ret = {"domain": domain, "user": user}
+    
+    if not isinstance(domain, str) or not isinstance(user, str):
+        ret["error"] = "domain and user must be strings"
+        return ret
+    
+    seqname = record.get("sequence") or default_sequence or pws.get_sequence_name(domain, user)
+    seq = pws.get_sequence(seqname) if isinstance(seqname, str) else None
+    
+    if not seq:
+        ret["error"] = "sequence '%s' not found" % seqname
+        return ret
+    
+    try:
+        check_forbidden_symbol_in_name(domain)
+        check_forbidden_symbol_in_name(user)
+    except ValueError as e:
+        ret["error"] = str(e)
+        return ret
+    
+    try:
+        password = execute_sequence(seq, key, domain, user, pw.config.OPTIMIZE_SEQUENCES)
+    except Exception as e:
+        ret["error"] = "sequence '%s' failed: %s" % (seq.name, e)
+        return ret
+    
+    ret["sequence"] = seq.name
+    ret["password"] = password
+    
+    return ret
+
+
+def batch(args):
+    """reads one {"domain", "user", "sequence"} json object per line from
+    stdin and writes one result object per line to stdout. records that
+    fail get an "error" instead of a "password". the pwlist4 file is
+    saved once at the end."""
+    import json
+    from pw.pwlist import save_changes
+    
+    key = read_key()
+    
+    if key is None:
+        return 0
     
-    vprintf("setting sequence of user %s of domain %s to %s", user, domain, seqname)
-    usr.sequence = seqname
+    count = 0
+    errors = 0
+    
+    # the users of the passwords already written are saved even if
+    # writing or reading stops early
+    try:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            
+            ret = batch_record(line, key, args.sequence)
+            count += 1
+            
+            if "error" in ret:
+                errors += 1
+            
+            out.write(json.dumps(ret) + "\n")
+            out.flush()
+            
+            if "password" in ret:
+                add_user(ret["domain"], ret["user"], ret["sequence"])
+    finally:
+        if save_changes(fp, pws):
+            vprintf("saved changes to '%s'", fp)
+    
+    vprintf("%d records, %d errors", count, errors)
+    return 1 if errors else 0
 
 
 # main
@@ -235,15 +435,39 @@ def main(args):
     global pws
     global fp
     
-    if args.file:
+    if not args.domain:
+        args.domain = ""
+    
+    if not args.user:
+        args.user = ""
+    
+    if args.list and not getattr(args, 'import') and not args.serve:
+        ret = complete_from_index(args)
+        
+        if ret is not None:
+            return ret
+    
+    from pw.pwlist import load_pwlist, save_changes, validate_pwfile
+    from pw.sequence import execute_sequence
+    
+    known = None
+    
+    if args.domain and not (args.list or getattr(args, 'import') or args.serve or args.batch):
+        known = load_known_user(args)
+    
+    if known:
+        vprintf("loaded domain '%s' from the domain index", args.domain)
+        pws = known
+        fp = args.file or pwlist4_path()
+        er = validate_pwfile(pws)
+    elif args.file:
         vprintf("loading from file: '%s'", args.file)
         pws = load_pwlist(args.file)
         fp = args.file
+        er = validate_pwfile(pws)
     else:
-        load_pws_from_default_paths()
+        er = load_pws_from_default_paths()
     
-    er = validate_pwfile(pws)
-        
     if er:
         err("%s", er)
         return 1
@@ -251,15 +475,18 @@ def main(args):
     if getattr(args, 'import'):
         return import_pwfile4(getattr(args, 'import'), args.force)
         
-    if not args.domain:
-        args.domain = ""
-    
-    if not args.user:
-        args.user = ""
+    if args.serve:
+        from pw.daemon import serve
+        serve(pws, fp, args.socket)
+        return 0
         
     if args.list:
         return complete(args)
-        
+    
+    if args.batch:
+        return batch(args)
+    
+    did_you_mean(args)
     seqname = get_sequence_name(args)
     seq = pws.get_sequence(seqname)
     
@@ -267,21 +494,18 @@ def main(args):
         err("sequence '%s' not found", seqname)
         return 1
     
-    key = None
+    key = read_key()
     
-    try:
-        key = getpass.getpass("Encryption key: ")
-    except EOFError:
-        print("\naborted")
-        return 0
-    except KeyboardInterrupt:
-        print("\naborted")
+    if key is None:
         return 0
     
     pw = execute_sequence(seq, key, args.domain, args.user)
     add_user(args.domain, args.user, seq.name)
-    vprintf("saving changes to '%s'", fp)
-    save_pwlist4(fp, pws)
+    
+    if save_changes(fp, pws):
+        vprintf("saved changes to '%s'", fp)
+    
+    import clipboard
     
     timeout = 5
     printf("password copied, clearing in %d seconds", timeout)
@@ -295,16 +519,22 @@ def main(args):
     
 def get_argument_parser():
     """creates and returns a parser for the command line arguments"""
-    parser = argparse.ArgumentParser(prog=PROG, formatter_class=argparse.RawDescriptionHelpFormatter, description="""password generator v%s
+    parser = argparse.ArgumentParser(prog=pw.config.PROG, formatter_class=argparse.RawDescriptionHelpFormatter, description="""password generator v%s
 by %s""" % (pw.config.VERSION, pw.config.AUTHOR))
 
     parser.add_argument('--version', action='version', version="%s v%s" % (pw.config.PROG, pw.config.VERSION))
     parser.add_argument('-v', '--verbose', help="display extra information", action="store_true")
     parser.add_argument('-q', '--quiet', help="display no messages", action="store_true")
     parser.add_argument('-l', '--list', help="list domains or users of a given domain", action="store_true")
+    parser.add_argument('--prefix', help="used with -l to only list names starting with the given prefix", default="")
+    parser.add_argument('--limit', help="used with -l to list at most the given number of names", type=int, default=None)
+    parser.add_argument('--fuzzy', help="used with -l to list the names most similar to the given name, best first", default=None)
     parser.add_argument('-s', '--sequence', help="generation sequence", default=None)
     parser.add_argument('-f', '--file', help="pwlist2 or pwlist4 file to use", default=None)
     parser.add_argument('-i', '--import', help="pwlist4 file to import", default=None)
+    parser.add_argument('--batch', help="read {\"domain\", \"user\", \"sequence\"} json objects from stdin, one per line, and write the results to stdout", action="store_true")
+    parser.add_argument('--serve', help="keep running and answer requests on a unix domain socket, see pw/daemon.py", action="store_true")
+    parser.add_argument('--socket', help="socket path used with --serve", default=None)
     parser.add_argument('--force', help="used with -i to force overwrite of local pwfile", action="store_true")
     parser.add_argument('--transformations', help="view available transformation functions", action="store_true")
 
@@ -316,7 +546,14 @@ by %s""" % (pw.config.VERSION, pw.config.AUTHOR))
 
 
 def __main__():
+    global out
+    
     args = get_argument_parser().parse_args()
+    
+    if args.batch:
+        # stdout is reserved for the results, messages go to stderr
+        out = sys.stdout
+        sys.stdout = sys.stderr
 
     pw.config._VERBOSE = args.verbose
     pw.config._QUIET = args.quiet
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# pw_b58.py: base58 codec (bitcoin alphabet)
+#
+# converts between bytes and base58 in chunks of 5 digits. 58**5 still
+# fits into a single digit of python's big integers, so every division
+# takes the fast path and there are 5 times fewer of them than when
+# dividing by 58.
+
+ALPHABET = b"123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+CHUNK_DIGITS = 5
+CHUNK = 58**CHUNK_DIGITS
+
+# all two digit combinations, indexed by their value
+PAIRS = [bytes([ALPHABET[i // 58], ALPHABET[i % 58]]) for i in range(58 * 58)]
+
+DIGITS = {c: i for i, c in enumerate(ALPHABET)}
+
+
+def b58encode(v):
+    """encodes bytes to base58, same as base58.b58encode"""
+    if isinstance(v, str):
+        v = v.encode("ascii")
+    elif not isinstance(v, (bytes, bytearray)):
+        raise TypeError("a bytes-like object is required, not '%s'" % type(v).__name__)
+
+    stripped = v.lstrip(b"\0")
+    n = int.from_bytes(stripped, "big")
+
+    chunks = []
+
+    while n:
+        n, r = divmod(n, CHUNK)
+        chunks.append(r)
+
+    parts = []
+
+    for r in reversed(chunks):
+        hi, lo = divmod(r, 58 * 58)
+        top, mid = divmod(hi, 58 * 58)
+        parts.append(ALPHABET[top:top+1] + PAIRS[mid] + PAIRS[lo])
+
+    # the most significant chunk is padded with zero digits, but the
+    # number itself starts with a nonzero one
+    ret = b"".join(parts).lstrip(ALPHABET[0:1])
+
+    return ALPHABET[0:1] * (len(v) - len(stripped)) + ret
+
+
+def b58decode(v):
+    """decodes base58 to bytes, same as base58.b58decode"""
+    if isinstance(v, str):
+        v = v.encode("ascii")
+
+    v = v.rstrip()
+    stripped = v.lstrip(ALPHABET[0:1])
+    n = 0
+
+    try:
+        for i in range(0, len(stripped), CHUNK_DIGITS):
+            part = stripped[i:i + CHUNK_DIGITS]
+            val = 0
+
+            for c in part:
+                val = val * 58 + DIGITS[c]
+
+            n = n * 58**len(part) + val
+    except KeyError as e:
+        raise ValueError("invalid character %r" % chr(e.args[0]))
+
+    return b"\0" * (len(v) - len(stripped)) + n.to_bytes((n.bit_length() + 7) // 8, "big")
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# pw_batch.py: batch versions of transformation functions
+
+from pw.transform import seed_key, seeded_random, to_string, default_wordlist
+from pw.hashing import prefix_digests
+
+def seed_many(inputs, min_int = 0, max_int = 2**32-1):
+    """returns [seed(s, min_int, max_int) for s in inputs]"""
+    # goes around seed_cache on purpose, bulk inputs would only evict
+    # the entries interactive use benefits from
+    return [seeded_random(seed_key(s)[1]).randint(min_int, max_int) for s in inputs]
+
+
+def diceware_many(inputs, min_count, max_count, words = None):
+    """returns [diceware_list(s, min_count, max_count, words) for s in inputs].
+    like seed_many it goes around seed_cache, which is all it saves over
+    calling diceware_list for every input."""
+    if words is None:
+        words = default_wordlist()
+
+    inputs = [to_string(s) for s in inputs]
+    counts = seed_many(inputs, min_count, max_count)
+
+    hashes = []
+
+    for s, count in zip(inputs, counts):
+        hashes += prefix_digests("sha256", s.encode(), [str(i).encode() for i in range(count)])
+
+    indices = iter(seed_many(hashes, 0, len(words)-1))
+
+    ret = []
+
+    for count in counts:
+        ret.append(str.join(' ', [words[next(indices)] for i in range(count)]))
+
+    return ret
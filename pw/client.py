@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# pw_client.py: client of the generation daemon
+#
+# connections to the daemon are kept in a pool and reused. requests are
+# pipelined: up to a window of requests is written before responses are
+# read, and responses, which may arrive out of order, are matched to
+# their requests by id. when no daemon is running, requests are answered
+# in-process instead, see LocalBackend.
+
+import json
+import queue
+import socket
+import threading
+from collections import deque
+from itertools import count
+
+from pw.protocol import *
+from pw.paths import pwlist4_path, socket_path
+from pw.util import *
+
+# requests written ahead of their responses on one connection
+PIPELINE_WINDOW = 64
+
+def response_result(response):
+    """returns the result of a response or raises its error"""
+    if "error" in response:
+        raise ValueError(response["error"])
+
+    return response["result"]
+
+
+class Connection():
+    def __init__(self, path, timeout = None):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.ids = count(1)
+        # responses that arrived before they were asked for
+        self.responses = {}
+
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def is_alive(self):
+        """whether the daemon still has this connection open"""
+        try:
+            self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+        # either closed or data nobody asked for
+        return False
+
+    def send(self, request):
+        """sends a request, returns its id"""
+        rid = next(self.ids)
+        self.sock.sendall(encode_frame(dict(request, id=rid)))
+        return rid
+
+    def recv_exactly(self, size):
+        buf = bytearray()
+
+        while len(buf) < size:
+            data = self.sock.recv(size - len(buf))
+
+            if not data:
+                raise ConnectionError("daemon closed the connection")
+
+            buf += data
+
+        return bytes(buf)
+
+    def receive(self, rid):
+        """returns the response to the request with the given id"""
+        while rid not in self.responses:
+            size = frame_size(self.recv_exactly(header.size))
+            response = json.loads(self.recv_exactly(size).decode())
+
+            if response.get("id") is None:
+                raise ConnectionError(response.get("error", "invalid response"))
+
+            self.responses[response["id"]] = response
+
+        return self.responses.pop(rid)
+
+    def pipeline(self, requests, window = PIPELINE_WINDOW):
+        """sends the requests and yields their responses in order"""
+        pending = deque()
+
+        for request in requests:
+            pending.append(self.send(request))
+
+            if len(pending) >= window:
+                yield self.receive(pending.popleft())
+
+        while pending:
+            yield self.receive(pending.popleft())
+
+    def close(self):
+        self.sock.close()
+
+
+class LocalBackend():
+    """answers requests in-process the way the daemon would"""
+    def __init__(self, fp = None):
+        self.fp = fp
+        self.pws = None
+        self.source = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """loads the pwlist file once, after that follows the changes
+        other processes save to it, see PwfileSource"""
+        if self.source:
+            self.pws = self.source.refresh()
+            return
+
+        from pw.pwlist import load_pwlist, validate_pwfile
+
+        if not self.fp:
+            self.fp = pwlist4_path()
+
+        pws = load_pwlist(self.fp)
+        er = validate_pwfile(pws)
+
+        if er:
+            raise ValueError(er)
+
+        self.pws = pws
+        self.source = PwfileSource(self.fp, pws)
+
+    def handle(self, request):
+        import pw.config
+        from pw.sequence import compile_sequence
+
+        rid = request.get("id")
+
+        try:
+            self.load()
+
+            op = request.get("op")
+
+            if op == "generate":
+                seq, key, domain, user = resolve_generate(self.pws, request)
+                password = compile_sequence(seq, pw.config.OPTIMIZE_SEQUENCES)(key, domain, user)
+                record_user(self.pws, domain, user, seq)
+                result = generate_result(domain, user, seq, password)
+            elif op == "list":
+                result = list_names(self.pws, request)[offset_field(request):]
+            elif op == "complete":
+                result = complete_names(self.pws, request)[offset_field(request):]
+            else:
+                raise ValueError("unknown op '%s'" % op)
+        except Exception as e:
+            return {"id": rid, "error": str(e)}
+
+        return {"id": rid, "result": result}
+
+    def pipeline(self, requests, window = PIPELINE_WINDOW):
+        try:
+            for request in requests:
+                with self.lock:
+                    response = self.handle(request)
+
+                yield response
+        finally:
+            self.save()
+
+    def save(self):
+        from pw.pwlist import save_changes
+
+        with self.lock:
+            if self.pws is not None and save_changes(self.fp, self.pws):
+                vprintf("saved changes to '%s'", self.fp)
+
+
+class Client():
+    """talks to the daemon on the given socket, or answers requests
+    in-process using the pwlist file fp if fallback is set and no daemon
+    is running. safe to share between threads."""
+    def __init__(self, path = None, pool_size = 4, window = PIPELINE_WINDOW, fallback = True, fp = None, timeout = None):
+        self.path = path or socket_path()
+        self.window = window
+        self.fallback = fallback
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(pool_size)
+        self.local = LocalBackend(fp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self):
+        """returns an idle connection from the pool or a new one"""
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                return Connection(self.path, self.timeout)
+
+            if conn.is_alive():
+                return conn
+
+            conn.close()
+
+    def release(self, conn):
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def pipeline(self, requests):
+        """sends the requests and yields their responses in order"""
+        try:
+            conn = self.connect()
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not self.fallback:
+                raise
+
+            vprintf("no daemon on %s, generating in-process", self.path)
+            yield from self.local.pipeline(requests, self.window)
+            return
+
+        done = False
+
+        try:
+            yield from conn.pipeline(requests, self.window)
+            done = True
+        finally:
+            # a connection with responses still on the way can't be reused
+            if done:
+                self.release(conn)
+            else:
+                conn.close()
+
+    def request(self, op, **fields):
+        response, = self.pipeline([dict(fields, op=op)])
+        return response_result(response)
+
+    def generate(self, key, domain, user, sequence = None):
+        """returns the password of the given user of the given domain"""
+        return self.request("generate", key=key, domain=domain, user=user, sequence=sequence)["password"]
+
+    def generate_many(self, key, pairs, sequence = None):
+        """yields (domain, user, password) for (domain, user) pairs in
+        input order, pipelining the requests on one connection"""
+        requests = ({"op": "generate", "key": key, "domain": domain, "user": user, "sequence": sequence} for domain, user in pairs)
+
+        for response in self.pipeline(requests):
+            result = response_result(response)
+            yield result["domain"], result["user"], result["password"]
+
+    def names(self, op, **fields):
+        """returns the names of a list or complete request, requesting
+        page after page"""
+        ret = []
+        offset = 0
+
+        while offset is not None:
+            response, = self.pipeline([dict(fields, op=op, offset=offset)])
+            ret += response_result(response)
+            offset = response.get("next")
+
+        return ret
+
+    def list(self, domain = ""):
+        """returns the domains or the users of the given domain"""
+        return self.names("list", domain=domain)
+
+    def complete(self, prefix, domain = ""):
+        """returns the domains or users of the given domain starting with prefix"""
+        return self.names("complete", prefix=prefix, domain=domain)
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+        self.local.save()
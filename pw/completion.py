@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# pw_completion.py: completion index of a pwlist file
+#
+# shell completion runs pw -l on every tab press. instead of parsing the
+# pwlist file each time, the names are kept sorted in a sidecar file next
+# to it, <pwlist file>.index:
+#   magic "PWCI", version, size and mtime (ns) of the pwlist file the
+#   index was built from and the size of the domains, all little endian,
+#   the sorted domain names as packed wordlist (see pw/wordlist.py),
+#   the sorted "<domain>\0<user>" pairs as packed wordlist.
+# the index is memory mapped and looked up by bisection. it is rebuilt
+# whenever the size or mtime of the pwlist file changes, which only
+# happens when pw -l is run after the pwlist file or its journal was
+# changed.
+
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+
+from pw.journal import journal_path
+from pw.wordlist import PackedWordlist, pack_words
+
+MAGIC = b"PWCI"
+VERSION = 1
+
+header = struct.Struct("<4sIQQQ")
+
+SEPARATOR = "\0"
+
+def index_path(path):
+    return path + ".index"
+
+
+def source_stat(path):
+    """returns what identifies a version of the pwlist file at path and
+    its journal, see pw/journal.py"""
+    st = os.stat(path)
+    size, mtime_ns = st.st_size, st.st_mtime_ns
+
+    try:
+        # the journal only grows until it's removed with a full save
+        st = os.stat(journal_path(path))
+        size += st.st_size
+        mtime_ns = max(mtime_ns, st.st_mtime_ns)
+    except OSError:
+        pass
+
+    return size, mtime_ns
+
+
+def build_index(pws, size = 0, mtime_ns = 0):
+    """returns the index of the names in pws, built from a file with the
+    given size and mtime"""
+    domains = pack_words(sorted(pws.domains.keys()))
+    pairs = pack_words(sorted(domain.name + SEPARATOR + user for domain in pws.domains.values() for user in domain.users.keys()))
+
+    # keep the offsets of the pairs aligned
+    domains += b"\0" * (-len(domains) % 4)
+
+    return header.pack(MAGIC, VERSION, size, mtime_ns, len(domains)) + domains + pairs
+
+
+class CompletionIndex:
+    """sorted domains and users of a pwlist file"""
+    def __init__(self, buf):
+        self.buf = buf
+        magic, version, self.size, self.mtime_ns, domains_size = header.unpack_from(buf)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a completion index")
+
+        view = memoryview(buf)
+        begin = header.size
+        self.domains = PackedWordlist(None, view[begin:begin + domains_size])
+        self.pairs = PackedWordlist(None, view[begin + domains_size:])
+
+    def complete(self, domain = "", prefix = "", limit = None):
+        """returns the domains starting with prefix or, if domain is given,
+        its users starting with prefix, sorted and at most limit names"""
+        if domain:
+            names = self.pairs
+            prefix = domain + SEPARATOR + prefix
+            skip = len(domain) + 1
+        else:
+            names = self.domains
+            skip = 0
+
+        ret = []
+        i = bisect_left(names, prefix)
+
+        while i < len(names) and (limit is None or len(ret) < limit):
+            name = names[i]
+
+            if not name.startswith(prefix):
+                break
+
+            ret.append(name[skip:])
+            i += 1
+
+        return ret
+
+
+def load_index(path):
+    """returns the index of the pwlist file at path or None if there's
+    none or it's out of date"""
+    try:
+        stat = source_stat(path)
+
+        with open(index_path(path), "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index = CompletionIndex(buf)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    if (index.size, index.mtime_ns) != stat:
+        return None
+
+    return index
+
+
+def update_index(path, pws):
+    """rebuilds the index of the pwlist file at path, which pws was loaded
+    from, and returns it. the index is kept in memory only if the pwlist
+    file doesn't exist or the index can't be written."""
+    try:
+        size, mtime_ns = source_stat(path)
+    except OSError:
+        return CompletionIndex(build_index(pws))
+
+    data = build_index(pws, size, mtime_ns)
+    write_sidecar(index_path(path), data)
+    return CompletionIndex(data)
+
+
+def write_sidecar(path, data):
+    """replaces the file at path with data, returns whether it worked.
+    sidecar files can always be rebuilt, so failing to write them isn't
+    an error."""
+    try:
+        # a unique name, so concurrent writers don't share the file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".")
+    except OSError:
+        return False
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+        return False
+
+    return True
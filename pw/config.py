@@ -8,6 +8,29 @@ VERSION = "2021.12.20"
 _VERBOSE = False
 _QUIET = False
 
+# maximum number of cached seed() results, 0 to disable
+SEED_CACHE_SIZE = 4096
+
+# fuse steps of sequences compiled by long-lived or bulk callers: the
+# daemon, the in-process client backend, generate_many and --batch. a
+# single generation doesn't optimize, checking the fused plan takes
+# longer than running the sequence. see pw/optimize.py
+OPTIMIZE_SEQUENCES = True
+
+# save pwlist4 files with sorted domains and a domain index, so single
+# domains can be loaded without parsing the file, see pw/domainindex.py
+SORTED_PWLIST = True
+
+# keep the last loaded valid pwlist file parsed, see pw/pwcache.py
+PWLIST_CACHE = True
+
+# bytes of changes appended to the journal of the pwlist4 file before it
+# is saved in full, 0 to always save it in full, see pw/journal.py
+JOURNAL_LIMIT = 64 * 1024
+
+# flush the pwlist4 file to disk when it's saved in full
+FSYNC_PWLIST = True
+
 
 if __name__ == "__main__":
     # self-update
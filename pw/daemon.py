@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# pw_daemon.py: generation daemon on a unix domain socket
+#
+# keeps the pwfile, the compiled sequences and the wordlist in memory and
+# answers requests over a unix domain socket. requests and responses are
+# json objects, each preceded by its length as 4 byte big endian integer.
+#
+# requests:
+#   {"id": 1, "op": "generate", "key": "...", "domain": "...", "user": "...", "sequence": "..."}
+#   {"id": 2, "op": "list", "domain": "..."}
+#   {"id": 3, "op": "complete", "prefix": "...", "domain": "..."}
+#
+# "sequence" is optional and works like -s, "domain" of list and complete
+# is optional and works like -l. responses carry the id of their request
+# and either a "result" or an "error". requests on the same connection are
+# handled concurrently, so responses may arrive out of order.
+#
+# no frame may be larger than MAX_FRAME_SIZE. the names list and complete
+# return are paged to fit: a response with more names to come carries
+# the "offset" of the next page as "next", to be passed along with the
+# same request.
+
+import asyncio
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import pw.config
+from pw.sequence import compile_sequence
+from pw.pwlist import journal_changes, save_changes
+from pw.paths import socket_path
+from pw.protocol import *
+from pw.util import *
+
+# seconds between a change to the pwfile and saving it
+SAVE_DELAY = 1.0
+
+async def read_frame(reader):
+    """returns the payload of the next frame or None at the end of the stream"""
+    try:
+        head = await reader.readexactly(header.size)
+    except asyncio.IncompleteReadError:
+        return None
+
+    return await reader.readexactly(frame_size(head))
+
+
+def names_response(names, request):
+    """the fields of the response with the page of names request asks for"""
+    page, offset = page_names(names, request)
+    ret = {"result": page}
+
+    if offset is not None:
+        ret["next"] = offset
+
+    return ret
+
+
+class Daemon():
+    def __init__(self, pws, fp, workers = None):
+        self.pws = pws
+        self.fp = fp
+        self.source = PwfileSource(fp, pws)
+        # changes handed to the save executor and not written yet
+        self.saving = []
+        # generation runs here, never on the event loop
+        self.executor = ThreadPoolExecutor(workers)
+        # so does saving, one save after the other
+        self.save_executor = ThreadPoolExecutor(1)
+        self.save_handle = None
+        self.ops = {"generate": self.generate, "list": self.list, "complete": self.complete}
+
+        for seq in pws.sequences.values():
+            try:
+                compile_sequence(seq, pw.config.OPTIMIZE_SEQUENCES)
+            except ValueError as e:
+                warn("sequence %s: %s", seq.name, e)
+
+    def refresh(self):
+        """follows the changes other processes saved to the pwlist file"""
+        self.pws = self.source.refresh(list(self.saving))
+
+    async def generate(self, request):
+        self.refresh()
+        seq, key, domain, user = resolve_generate(self.pws, request)
+        plan = compile_sequence(seq, pw.config.OPTIMIZE_SEQUENCES)
+        loop = asyncio.get_running_loop()
+        password = await loop.run_in_executor(self.executor, plan, key, domain, user)
+        self.refresh()
+
+        if record_user(self.pws, domain, user, seq):
+            self.schedule_save()
+
+        return {"result": generate_result(domain, user, seq, password)}
+
+    async def list(self, request):
+        self.refresh()
+        return names_response(list_names(self.pws, request), request)
+
+    async def complete(self, request):
+        self.refresh()
+        return names_response(complete_names(self.pws, request), request)
+
+    def schedule_save(self):
+        """saves the pwfile SAVE_DELAY seconds from now unless a save is
+        already scheduled, so bursts of new users are written once"""
+        if self.save_handle is None:
+            self.save_handle = asyncio.get_running_loop().call_later(SAVE_DELAY, self.save)
+
+    def save(self):
+        """saves the changes recorded so far. the journal is written and
+        compacted in the save executor, so flushing it to disk doesn't
+        block the event loop."""
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
+
+        if not self.pws.changes:
+            return
+
+        if not os.path.exists(self.fp):
+            # there's nothing to journal to, pws is saved as a whole
+            if save_changes(self.fp, self.pws):
+                vprintf("saved changes to '%s'", self.fp)
+
+            return
+
+        # users recorded while saving go to the next save
+        changes = self.pws.changes
+        self.pws.changes = []
+        self.saving.append(changes)
+        self.save_executor.submit(self.write_changes, changes)
+
+    def write_changes(self, changes):
+        try:
+            journal_changes(self.fp, changes)
+        except Exception as e:
+            warn("saving changes to '%s' failed: %s", self.fp, e)
+            return
+        finally:
+            self.saving.remove(changes)
+
+        vprintf("saved changes to '%s'", self.fp)
+
+    async def respond(self, payload, writer):
+        rid = None
+
+        try:
+            request = decode_request(payload)
+            rid = request.get("id")
+            op = self.ops.get(request.get("op"))
+
+            if not op:
+                raise ValueError("unknown op '%s'" % request.get("op"))
+
+            response = {"id": rid}
+            response.update(await op(request))
+        except Exception as e:
+            response = {"id": rid, "error": str(e)}
+
+        frame = encode_frame(response)
+
+        # the client would close the connection
+        if len(frame) - header.size > MAX_FRAME_SIZE:
+            frame = encode_frame({"id": rid, "error": "response too large (%d bytes)" % (len(frame) - header.size)})
+
+        if not writer.is_closing():
+            writer.write(frame)
+
+    async def handle(self, reader, writer):
+        """serves one connection"""
+        tasks = set()
+
+        try:
+            while True:
+                try:
+                    payload = await read_frame(reader)
+                except ValueError as e:
+                    writer.write(encode_frame({"id": None, "error": str(e)}))
+                    break
+
+                if payload is None:
+                    break
+
+                task = asyncio.ensure_future(self.respond(payload, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+                # don't let a client that does not read pile up responses
+                await writer.drain()
+
+            if tasks:
+                await asyncio.gather(*tasks)
+
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # client gone or daemon shutting down
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.save()
+        self.save_executor.shutdown()
+        self.executor.shutdown()
+
+
+def remove_stale_socket(path):
+    """removes the socket file of a daemon that is no longer running"""
+    if not os.path.exists(path):
+        return
+
+    s = socket.socket(socket.AF_UNIX)
+
+    try:
+        s.connect(path)
+    except OSError:
+        vprintf("removing stale socket %s", path)
+        os.unlink(path)
+        return
+    finally:
+        s.close()
+
+    raise ValueError("already serving on %s" % path)
+
+
+async def start_server(daemon, path):
+    """listens on the given path, only the current user may connect"""
+    remove_stale_socket(path)
+
+    parent = os.path.dirname(path)
+    if parent and not os.path.exists(parent):
+        os.makedirs(parent)
+
+    umask = os.umask(0o177)
+
+    try:
+        server = await asyncio.start_unix_server(daemon.handle, path)
+    finally:
+        os.umask(umask)
+
+    os.chmod(path, 0o600)
+    return server
+
+
+async def run(daemon, path):
+    server = await start_server(daemon, path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    info("listening on %s", path)
+
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        daemon.close()
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def serve(pws, fp, path = None, workers = None):
+    """runs the daemon until interrupted"""
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("unix domain sockets are not supported on this system")
+
+    asyncio.run(run(Daemon(pws, fp, workers), path or socket_path()))
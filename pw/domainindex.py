@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# pw_domainindex.py: sparse offset index of a sorted pwlist4 file
+#
+# save_pwlist4 can write the domains sorted by name. it then keeps the
+# name and file offset of every BLOCK_SIZE-th domain in a sidecar file
+# next to the pwlist file, <pwlist file>.domains:
+#   magic "PWDI", version, size and mtime (ns) of the pwlist file, the
+#   size of the names and the offset of the sequences, all little endian,
+#   the sampled domain names as packed wordlist (see pw/wordlist.py),
+#   padded to 8 bytes,
+#   the offsets of the sampled domains as 8 byte little endian integers.
+# a single domain is found by bisecting the sampled names and parsing
+# the file from the offset before it, see load_pwlist4_domain. offsets
+# are positions returned by tell() of the pwlist file opened as text.
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from pw.completion import write_sidecar
+from pw.wordlist import PackedWordlist, pack_words
+
+MAGIC = b"PWDI"
+VERSION = 1
+
+header = struct.Struct("<4sIQQQQ")
+
+# domains per sampled offset
+BLOCK_SIZE = 32
+
+def domain_index_path(path):
+    return path + ".domains"
+
+
+def build_domain_index(names, offsets, sequences, size = 0, mtime_ns = 0):
+    """returns the index of sampled domain names at the given offsets of
+    a file with the given size and mtime, its sequences at offset
+    sequences"""
+    packed = pack_words(names)
+    packed += b"\0" * (-len(packed) % 8)
+    offsets = array("Q", offsets)
+
+    if sys.byteorder != "little":
+        offsets.byteswap()
+
+    return header.pack(MAGIC, VERSION, size, mtime_ns, len(packed), sequences) + packed + offsets.tobytes()
+
+
+class DomainIndex:
+    """sampled domains of a sorted pwlist4 file and their offsets"""
+    def __init__(self, buf):
+        self.buf = buf
+        magic, version, self.size, self.mtime_ns, names_size, self.sequences = header.unpack_from(buf)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a domain index")
+
+        view = memoryview(buf)
+        begin = header.size + names_size
+        self.names = PackedWordlist(None, view[header.size:begin])
+
+        if sys.byteorder == "little":
+            self.offsets = view[begin:].cast("Q")
+        else:
+            self.offsets = array("Q", bytes(view[begin:]))
+            self.offsets.byteswap()
+
+        if len(self.offsets) != len(self.names):
+            raise ValueError("domain index is truncated")
+
+    def block(self, name):
+        """returns the offset of the block of domains that contains the
+        domain name, if it's in the file, or None"""
+        i = bisect_right(self.names, name) - 1
+
+        if i < 0:
+            return None
+
+        return self.offsets[i]
+
+
+def file_stat(path):
+    """returns what identifies a version of the pwlist file at path. its
+    journal isn't included, it's replayed by load_pwlist4_domain."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def load_domain_index(path):
+    """returns the domain index of the pwlist file at path or None if
+    there's none or it's out of date"""
+    try:
+        stat = file_stat(path)
+
+        with open(domain_index_path(path), "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index = DomainIndex(buf)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    if (index.size, index.mtime_ns) != stat:
+        return None
+
+    return index
+
+
+def update_domain_index(path, names, offsets, sequences):
+    """writes the domain index of the pwlist file at path, which was just
+    saved sorted"""
+    try:
+        size, mtime_ns = file_stat(path)
+    except OSError:
+        return False
+
+    return write_sidecar(domain_index_path(path), build_domain_index(names, offsets, sequences, size, mtime_ns))
+
+
+def remove_domain_index(path):
+    """removes the domain index of the pwlist file at path, if any"""
+    try:
+        os.remove(domain_index_path(path))
+    except OSError:
+        pass
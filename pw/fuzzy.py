@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# pw_fuzzy.py: fuzzy lookup of domains and users
+#
+# names are compared by their trigrams, the sets of 3 character
+# substrings of the lower case name padded with two spaces in front and
+# one at the end, e.g. "  g", " gi", "git", ... "om " for github.com.
+# the similarity of two names is the number of shared trigrams divided
+# by the number of distinct trigrams of both (jaccard index).
+#
+# domains are found through a trigram index, which is built from the
+# completion index (see pw/completion.py) on first use and kept next to
+# the pwlist file in <pwlist file>.trigrams:
+#   magic "PWTG", version, size and mtime (ns) of the pwlist file and
+#   the size of the trigrams, all little endian,
+#   the sorted trigrams as packed wordlist (see pw/wordlist.py),
+#   count + 1 offsets into the postings as 4 byte little endian integers,
+#   the postings: for every trigram the ascending indexes of the domains
+#   containing it, in the sorted domains of the completion index, as 4
+#   byte little endian integers.
+# users of a domain are few, so they are compared one by one.
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from pw.completion import source_stat, write_sidecar
+from pw.wordlist import PackedWordlist, pack_words
+
+MAGIC = b"PWTG"
+VERSION = 1
+
+header = struct.Struct("<4sIQQQ")
+
+# postings are counted for the rarest trigrams of a query until this many
+# were counted, the best candidates are then compared by their trigrams.
+# without it, trigrams like "com" would count almost every domain.
+MAX_POSTINGS = 20000
+MAX_CANDIDATES = 200
+
+# the least similarity for "did you mean"
+SUGGEST_SIMILARITY = 0.4
+
+def trigram_path(path):
+    return path + ".trigrams"
+
+
+def trigrams(name):
+    s = "  " + name.lower() + " "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def similarity(a, b):
+    """similarity of two sets of trigrams, between 0 and 1"""
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+def rank(query, names, limit, min_similarity):
+    """returns up to limit names most similar to the trigrams in query"""
+    scored = []
+
+    for name in names:
+        score = similarity(query, trigrams(name))
+
+        if score >= min_similarity and score > 0:
+            scored.append((-score, name))
+
+    scored.sort()
+    return [name for score, name in scored[:limit]]
+
+
+def uint32_array(buf):
+    """4 byte little endian integers in buf, without copying if possible"""
+    if sys.byteorder == "little":
+        return memoryview(buf).cast("I")
+
+    ret = array("I", bytes(buf))
+    ret.byteswap()
+    return ret
+
+
+def build_trigrams(index):
+    """returns the trigram index of the domains in a completion index"""
+    postings = {}
+
+    for i, name in enumerate(index.domains):
+        for t in trigrams(name):
+            p = postings.get(t)
+
+            if p is None:
+                p = postings[t] = array("I")
+
+            p.append(i)
+
+    keys = sorted(postings.keys())
+    offsets = array("I", [0])
+    data = array("I")
+
+    for t in keys:
+        data.extend(postings[t])
+        offsets.append(len(data))
+
+    if sys.byteorder != "little":
+        offsets.byteswap()
+        data.byteswap()
+
+    packed = pack_words(keys)
+    packed += b"\0" * (-len(packed) % 4)
+
+    return header.pack(MAGIC, VERSION, index.size, index.mtime_ns, len(packed)) + packed + offsets.tobytes() + data.tobytes()
+
+
+class FuzzyIndex:
+    """ranked suggestions of domains and users of a completion index"""
+    def __init__(self, buf, index):
+        self.buf = buf
+        self.index = index
+        magic, version, self.size, self.mtime_ns, trigrams_size = header.unpack_from(buf)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a trigram index")
+
+        view = memoryview(buf)
+        begin = header.size + trigrams_size
+        self.trigrams = PackedWordlist(None, view[header.size:begin])
+        end = begin + (len(self.trigrams) + 1) * 4
+        self.offsets = uint32_array(view[begin:end])
+        self.postings = uint32_array(view[end:])
+
+    def domain_postings(self, t):
+        i = bisect_left(self.trigrams, t)
+
+        if i == len(self.trigrams) or self.trigrams[i] != t:
+            return None
+
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def suggest_domains(self, query, limit = 10, min_similarity = 0.0):
+        """returns up to limit domains similar to query, best first"""
+        q = trigrams(query)
+        lists = [p for p in map(self.domain_postings, q) if p is not None]
+        lists.sort(key=len)
+        counts = Counter()
+        counted = 0
+
+        for p in lists:
+            if counted and counted + len(p) > MAX_POSTINGS:
+                break
+
+            counts.update(p)
+            counted += len(p)
+
+        domains = self.index.domains
+        candidates = [domains[i] for i, count in counts.most_common(MAX_CANDIDATES)]
+        return rank(q, candidates, limit, min_similarity)
+
+    def suggest_users(self, domain, query, limit = 10, min_similarity = 0.0):
+        """returns up to limit users of domain similar to query, best first"""
+        return rank(trigrams(query), self.index.complete(domain), limit, min_similarity)
+
+
+def load_fuzzy_index(path, index):
+    """returns the trigram index for the completion index of the pwlist
+    file at path or None if there's none or it's out of date"""
+    try:
+        with open(trigram_path(path), "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        ret = FuzzyIndex(buf, index)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    if (ret.size, ret.mtime_ns) != (index.size, index.mtime_ns):
+        return None
+
+    return ret
+
+
+def fuzzy_index(path, index):
+    """returns the trigram index for the completion index of the pwlist
+    file at path, building it if needed"""
+    ret = load_fuzzy_index(path, index)
+
+    if ret:
+        return ret
+
+    data = build_trigrams(index)
+
+    try:
+        # only indexes of the current pwlist file are kept
+        if source_stat(path) == (index.size, index.mtime_ns):
+            write_sidecar(trigram_path(path), data)
+    except OSError:
+        pass
+
+    return FuzzyIndex(data, index)
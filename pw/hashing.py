@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# pw_hashing.py: hashing many inputs that share a prefix
+
+import hashlib
+
+class PrefixHasher():
+    """hashes inputs of the form prefix + suffix with one or more algorithms.
+    the prefix is fed into every hash once and each digest starts from a
+    copy of that state instead of hashing the prefix again."""
+    def __init__(self, prefix = b"", algorithms = ("sha256", "sha512")):
+        self.prefix = bytearray(prefix)
+        self.hashers = {a: getattr(hashlib, a)(self.prefix) for a in algorithms}
+
+    def __len__(self):
+        return len(self.prefix)
+
+    def extend(self, data):
+        """appends data to the prefix"""
+        self.prefix += data
+
+        for h in self.hashers.values():
+            h.update(data)
+
+    def digest(self, algorithm, suffix = b""):
+        """returns the digest of prefix + suffix"""
+        h = self.hashers[algorithm].copy()
+        h.update(suffix)
+        return h.digest()
+
+    def to_int(self, suffix = b""):
+        """returns int.from_bytes(prefix + suffix, "big") without copying
+        the prefix"""
+        mark = len(self.prefix)
+        self.prefix += suffix
+        n = int.from_bytes(self.prefix, "big")
+        del self.prefix[mark:]
+        return n
+
+
+def prefix_digests(algorithm, prefix, suffixes):
+    """returns the digests of prefix + suffix for every suffix, hashing the
+    prefix only once"""
+    h = getattr(hashlib, algorithm)(prefix)
+    ret = []
+
+    for suffix in suffixes:
+        c = h.copy()
+        c.update(suffix)
+        ret.append(c.digest())
+
+    return ret
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# pw_journal.py: append-only journal of changes to a pwlist file
+#
+# instead of rewriting the whole pwlist file for every new user, changes
+# are appended to <pwlist file>.journal, one json array per line:
+#   ["user", domain, user, sequence]    see Pwfile.add_user
+#   ["rename", sequence, new name]      see Pwfile.rename_sequence
+# load_pwlist4 replays the journal on top of the file. once the journal
+# is larger than pw.config.JOURNAL_LIMIT bytes, the pwlist file is saved
+# in full, which removes the journal, see save_changes.
+
+import os
+
+from pw.util import *
+
+def journal_path(path):
+    return path + ".journal"
+
+
+def journal_size(path):
+    """returns the size of the journal of the pwlist file at path"""
+    try:
+        return os.path.getsize(journal_path(path))
+    except OSError:
+        return 0
+
+
+def read_journal(path):
+    """returns the changes in the journal of the pwlist file at path"""
+    jp = journal_path(path)
+
+    try:
+        with open(jp, encoding="utf-8") as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
+        return []
+
+    return parse_changes(lines, jp)
+
+
+def read_journal_tail(path, offset):
+    """returns the changes in the complete lines of the journal of the
+    pwlist file at path from byte offset on, and the offset after them"""
+    jp = journal_path(path)
+
+    try:
+        with open(jp, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+
+    # a line without its newline may still be being appended
+    end = data.rfind(b"\n") + 1
+    lines = data[:end].decode("utf-8", "replace").split("\n")
+    return parse_changes(lines, jp), offset + end
+
+
+def parse_changes(lines, jp):
+    import json
+
+    ret = []
+
+    for i, line in enumerate(lines):
+        if not line:
+            continue
+
+        try:
+            ret.append(json.loads(line))
+        except ValueError:
+            # e.g. the end of an interrupted append
+            warn("ignoring broken change in line %d of '%s'", i + 1, jp)
+
+    return ret
+
+
+def append_changes(path, changes):
+    """appends changes to the journal of the pwlist file at path"""
+    import json
+
+    data = "".join(json.dumps(change) + "\n" for change in changes).encode("utf-8")
+
+    with open(journal_path(path), "ab+") as f:
+        # don't continue the end of an interrupted append
+        if f.seek(0, os.SEEK_END) and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+            data = b"\n" + data
+
+        f.write(data)
+
+
+def replay(pws, changes, domain = None):
+    """applies changes to pws, only the changes of the users of domain if
+    it's given. pws is left without changes to save."""
+    from pw.pwlist import check_forbidden_symbol_in_name
+    
+    for change in changes:
+        try:
+            if change[0] == "user" and len(change) == 4:
+                if domain is None or change[1] == domain:
+                    # names the parser would refuse would fail validate_pwfile
+                    for name in change[1:]:
+                        check_forbidden_symbol_in_name(name)
+                    
+                    pws.add_user(*change[1:])
+            elif change[0] == "rename" and len(change) == 3:
+                pws.rename_sequence(*change[1:])
+            else:
+                warn("ignoring unknown change %s in the journal", change)
+        except (ValueError, TypeError, IndexError) as e:
+            warn("ignoring change %s in the journal: %s", change, e)
+
+    pws.changes = []
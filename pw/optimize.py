@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# pw_optimize.py: peephole optimizer for compiled sequences
+#
+# works on the steps of a SequencePlan, i.e. (function, arguments, field
+# slots) tuples, and fuses runs of steps into single equivalent steps:
+# - append, prepend and init into one concatenation
+# - single character replace into one str.translate
+# - cut and limit into one cut
+
+import random
+
+from pw.transform import to_string, append, prepend, init, cut, limit, replace
+
+# generated inputs used to check optimized plans against the original ones
+VERIFY_ROUNDS = 32
+VERIFY_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 +/=:@.-_#äöüß€"
+
+
+def step_arguments(step):
+    """returns the arguments of a step as ("const", value) or ("field", index)"""
+    func, args, slots = step
+    ret = [("const", a) for a in args]
+
+    for i, field in slots:
+        ret[i] = ("field", field)
+
+    return ret
+
+
+def make_step(func, arguments):
+    """inverse of step_arguments"""
+    args = []
+    slots = []
+
+    for i, (typ, value) in enumerate(arguments):
+        if typ == "field":
+            slots.append((i, value))
+            args.append(None)
+        else:
+            args.append(value)
+
+    return (func, tuple(args), tuple(slots))
+
+
+# append / prepend / init
+def affix_parts(step):
+    """returns the (prefix, suffix) arguments a step adds to its input or
+    None if it is no concatenation"""
+    func = step[0]
+    arguments = step_arguments(step)
+
+    if func is append:
+        return [], arguments
+
+    if func is prepend:
+        return arguments, []
+
+    if func is init:
+        key, domain, user = arguments
+        return [], [key, ("const", ":"), user, ("const", "@"), domain]
+
+    return None
+
+
+def fold_constants(parts):
+    """joins neighbouring constant parts"""
+    ret = []
+
+    for typ, value in parts:
+        if typ == "const" and ret and ret[-1][0] == "const":
+            ret[-1] = ("const", ret[-1][1] + str(value))
+        elif typ == "const":
+            ret.append(("const", str(value)))
+        else:
+            ret.append((typ, value))
+
+    return ret
+
+
+def fuse_affixes(steps):
+    prefix = []
+    suffix = []
+
+    for step in steps:
+        p, s = affix_parts(step)
+        prefix = p + prefix
+        suffix = suffix + s
+
+    prefix = fold_constants(prefix)
+    suffix = fold_constants(suffix)
+    count = len(prefix)
+
+    def concatenate(s, *parts):
+        return str.join("", map(str, parts[:count])) + to_string(s) + str.join("", map(str, parts[count:]))
+
+    return make_step(concatenate, prefix + suffix)
+
+
+# replace
+def is_char_replacement(step):
+    func = step[0]
+
+    if func is not replace or step[2]:
+        return False
+
+    to_replace, replacement = step[1]
+
+    return isinstance(to_replace, str) and len(to_replace) == 1 and isinstance(replacement, str)
+
+
+def fuse_replacements(steps):
+    pairs = [step[1] for step in steps]
+
+    # replacing single characters one after the other is the same as
+    # mapping every character of the input through all replacements
+    def apply(c):
+        for to_replace, replacement in pairs:
+            c = c.replace(to_replace, replacement)
+        return c
+
+    table = {ord(c): apply(c) for c, r in pairs}
+
+    def translate(s):
+        if not isinstance(s, str):
+            # keep the behaviour (i.e. the error) of the original steps
+            for to_replace, replacement in pairs:
+                s = replace(s, to_replace, replacement)
+            return s
+
+        return s.translate(table)
+
+    return make_step(translate, [])
+
+
+# cut / limit
+def cut_bounds(step):
+    """returns the constant (begin, end) of a cut or limit step or None"""
+    func, args, slots = step
+
+    if slots or not all(isinstance(a, int) for a in args):
+        return None
+
+    if func is cut:
+        return args
+
+    if func is limit:
+        return (0, args[0])
+
+    return None
+
+
+def fuse_cuts(steps):
+    begin, end = cut_bounds(steps[0])
+
+    for step in steps[1:]:
+        b, e = cut_bounds(step)
+        begin = max(begin, 0)
+
+        # cutting [b, e) out of s[begin:end] is cutting s[begin + b:begin + e],
+        # but never past the first end
+        begin, end = begin + max(b, 0), min(begin + e, end)
+
+    return make_step(cut, [("const", begin), ("const", end)])
+
+
+fusions = [
+    (lambda step: affix_parts(step) is not None, fuse_affixes),
+    (is_char_replacement, fuse_replacements),
+    (lambda step: cut_bounds(step) is not None, fuse_cuts),
+]
+
+
+def optimize_steps(steps):
+    """returns the optimized steps and whether anything was changed"""
+    ret = []
+    changed = False
+    i = 0
+
+    while i < len(steps):
+        for matches, fuse in fusions:
+            j = i
+
+            while j < len(steps) and matches(steps[j]):
+                j += 1
+
+            if j - i > 1:
+                ret.append(fuse(steps[i:j]))
+                changed = True
+                i = j
+                break
+        else:
+            ret.append(steps[i])
+            i += 1
+
+    return ret, changed
+
+
+def random_field(rng):
+    length = rng.choice([0, 1, 2, 5, 12, 40])
+    return str.join("", [rng.choice(VERIFY_ALPHABET) for i in range(length)])
+
+
+def outcome(plan, key, domain, user):
+    try:
+        return plan(key, domain, user)
+    except Exception as e:
+        return type(e)
+
+
+def verify_plans(plan, optimized, rounds = VERIFY_ROUNDS):
+    """checks that both plans give the same results on generated inputs"""
+    rng = random.Random(0)
+
+    for i in range(rounds):
+        fields = (random_field(rng), random_field(rng), random_field(rng))
+
+        if outcome(plan, *fields) != outcome(optimized, *fields):
+            return False
+
+    return True
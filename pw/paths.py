@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# pw_paths.py: default file locations
+#
+# resolved on first use, so commands that are given a file don't import
+# appdirs and nothing touches the file system at import time.
+
+import os
+from functools import lru_cache
+
+from pw.config import PROG, AUTHOR
+
+@lru_cache(None)
+def local_dir():
+    import appdirs
+    return appdirs.user_data_dir()
+
+
+@lru_cache(None)
+def data_dir():
+    import appdirs
+    return appdirs.user_data_dir(PROG, AUTHOR)
+
+
+def pwlist2_legacy_path():
+    return os.path.join(local_dir(), ".pwlist2")
+
+
+def pwlist4_path():
+    return os.path.join(data_dir(), "pwlist4")
+
+
+def pwlist4_cache_path():
+    return os.path.join(data_dir(), "pwlist4.cache")
+
+
+def socket_path():
+    return os.path.join(data_dir(), "pw.sock")
+
+
+def wordlists_dir():
+    return os.path.join(data_dir(), "wordlists")
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# pw_protocol.py: requests of the generation daemon
+#
+# shared by the daemon (pw/daemon.py) and its client (pw/client.py), the
+# client also uses these to answer requests in-process when no daemon
+# is running. see pw/daemon.py for the protocol itself.
+
+import json
+import struct
+
+from pw.completion import source_stat
+from pw.domainindex import file_stat
+from pw.journal import journal_size, read_journal_tail, replay
+from pw.pwlist import check_forbidden_symbol_in_name, load_pwlist, validate_pwfile
+from pw.util import *
+
+header = struct.Struct(">I")
+
+# larger frames close the connection
+MAX_FRAME_SIZE = 1 << 20
+
+# bytes of names in one list or complete response, see page_names
+PAGE_SIZE = MAX_FRAME_SIZE // 2
+
+def encode_frame(obj):
+    data = json.dumps(obj).encode()
+    return header.pack(len(data)) + data
+
+
+def frame_size(head):
+    """returns the payload size given the header of a frame"""
+    size, = header.unpack(head)
+
+    if size > MAX_FRAME_SIZE:
+        raise ValueError("frame too large (%d bytes)" % size)
+
+    return size
+
+
+def decode_request(payload):
+    request = json.loads(payload.decode())
+
+    if not isinstance(request, dict):
+        raise ValueError("expected an object")
+
+    return request
+
+
+def string_field(request, name):
+    value = request.get(name) or ""
+
+    if not isinstance(value, str):
+        raise ValueError("%s must be a string" % name)
+
+    return value
+
+
+def offset_field(request):
+    value = request.get("offset") or 0
+
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError("offset must be a non-negative integer")
+
+    return value
+
+
+def resolve_generate(pws, request):
+    """returns the sequence, key, domain and user of a generate request"""
+    key = string_field(request, "key")
+    domain = string_field(request, "domain")
+    user = string_field(request, "user")
+    seqname = string_field(request, "sequence") or pws.get_sequence_name(domain, user)
+    seq = pws.get_sequence(seqname)
+
+    if not seq:
+        raise ValueError("sequence '%s' not found" % seqname)
+
+    check_forbidden_symbol_in_name(domain)
+    check_forbidden_symbol_in_name(user)
+
+    return seq, key, domain, user
+
+
+def record_user(pws, domain, user, seq):
+    """records that the user uses seq, returns whether pws changed"""
+    return pws.add_user(domain, user, seq.name)
+
+
+def generate_result(domain, user, seq, pw):
+    return {"domain": domain, "user": user, "sequence": seq.name, "password": pw}
+
+
+def list_names(pws, request):
+    domain = string_field(request, "domain")
+
+    if not domain:
+        return list(pws.domains.keys())
+
+    dom = pws.domains.get(domain)
+
+    if not dom:
+        return []
+
+    return list(dom.users.keys())
+
+
+def complete_names(pws, request):
+    prefix = string_field(request, "prefix")
+    return [name for name in list_names(pws, request) if name.startswith(prefix)]
+
+
+def page_names(names, request):
+    """returns the names from the offset of the request on that fit in
+    PAGE_SIZE bytes of json, and the offset of the next page or None.
+    a page holds at least one name."""
+    offset = offset_field(request)
+    end = offset
+    size = 2
+
+    while end < len(names):
+        size += len(json.dumps(names[end])) + 2
+
+        if size > PAGE_SIZE and end > offset:
+            break
+
+        end += 1
+
+    return names[offset:end], (end if end < len(names) else None)
+
+
+class PwfileSource():
+    """the Pwfile of a long-lived process answering requests and the
+    pwlist file fp it was loaded from. other processes keep saving users
+    to fp, refresh picks up their changes before pws is used."""
+    def __init__(self, fp, pws):
+        self.fp = fp
+        self.pws = pws
+        # unknown, the first refresh replays the whole journal again
+        self.stat = None
+        self.journal_offset = 0
+
+        try:
+            self.file_stat = file_stat(fp)
+        except OSError:
+            self.file_stat = None
+
+    def refresh(self, saving = ()):
+        """returns pws, brought up to date with fp if fp changed since the
+        last refresh. if only the journal grew, the new changes are
+        replayed, otherwise fp is loaded again. the changes of pws and
+        those in saving, which are being saved, stay applied on top."""
+        try:
+            stat = source_stat(self.fp)
+            fstat = file_stat(self.fp)
+        except OSError:
+            return self.pws
+
+        if stat == self.stat:
+            return self.pws
+
+        pending = self.pws.changes
+
+        if fstat == self.file_stat and journal_size(self.fp) >= self.journal_offset:
+            pws = self.pws
+            changes, self.journal_offset = read_journal_tail(self.fp, self.journal_offset)
+            replay(pws, changes)
+        else:
+            vprintf("reloading '%s'", self.fp)
+
+            # changes appended while loading are replayed again next time
+            offset = journal_size(self.fp)
+            pws = load_pwlist(self.fp)
+            er = validate_pwfile(pws)
+
+            if er:
+                warn("not reloading '%s': %s", self.fp, er)
+                self.stat = stat
+                return self.pws
+
+            self.file_stat = fstat
+            self.journal_offset = offset
+
+        for changes in saving:
+            replay(pws, changes)
+
+        replay(pws, pending)
+        pws.changes = pending
+        self.stat = stat
+        self.pws = pws
+        return pws
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# pw_pwcache.py: cache of the parsed and validated pwlist file
+#
+# parsing and validating a large pwlist file takes most of the time of a
+# run, so the last valid Pwfile loaded from the default pwlist4 file is
+# kept in <data dir>/pwlist4.cache as two marshalled objects:
+#   the key: cache version, python cache tag, absolute path, size and
+#   mtime (ns) of the pwlist file and its journal (see pw/completion.py)
+#   and the sha256 of both,
+#   the pwfile as nested tuples, see pwfile_to_tuples.
+# marshal only keeps builtin types, but is much faster than pickle, which
+# would restore every Domain and User through __reduce__.
+
+import gc
+import hashlib
+import marshal
+import os
+import sys
+
+import pw.config
+from pw.completion import source_stat, write_sidecar
+from pw.journal import journal_path
+from pw.pwlist import Pwfile, Domain, User, validate_pwfile
+from pw.sequence import Sequence, Segment, Param
+
+VERSION = 1
+
+def file_digest(path):
+    h = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1 << 20), b""):
+            h.update(data)
+
+    return h.digest()
+
+
+def cache_key(path):
+    """returns what identifies the contents of the file at path and its
+    journal, see pw/journal.py"""
+    stat = source_stat(path)
+    digest = file_digest(path)
+
+    try:
+        journal_digest = file_digest(journal_path(path))
+    except FileNotFoundError:
+        journal_digest = None
+
+    return (VERSION, sys.implementation.cache_tag, os.path.abspath(path)) + stat + (digest, journal_digest)
+
+
+def pwfile_to_tuples(pws):
+    domains = tuple((d.name, tuple((u.name, u.sequence) for u in d.users.values())) for d in pws.domains.values())
+    sequences = tuple((s.name, s.default, tuple((g.function, tuple((p.typ, p.value) for p in g.parameters)) for g in s.segments)) for s in pws.sequences.values())
+    return pws.default, domains, sequences
+
+
+def pwfile_from_tuples(data):
+    default, domains, sequences = data
+    ret = Pwfile()
+    ret.default = default
+    ret.sequences = {}
+
+    for name, seqdefault, segments in sequences:
+        seq = ret.sequences[name] = Sequence(name)
+        seq.default = seqdefault
+
+        for function, params in segments:
+            seg = Segment(function)
+            seg.parameters = [Param(typ, value) for typ, value in params]
+            seq.segments.append(seg)
+
+    pwsdomains = ret.domains
+
+    for name, users in domains:
+        domain = pwsdomains[name] = Domain(name)
+        domainusers = domain.users
+
+        for usr, seq in users:
+            domainusers[usr] = User(usr, seq)
+
+    return ret
+
+
+def read_cache(cache_path, key):
+    """returns the Pwfile in the cache at cache_path if it was cached with
+    key, otherwise None"""
+    # the objects are all kept, collecting while creating them would only
+    # scan them over and over
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        with open(cache_path, "rb") as f:
+            if marshal.load(f) != key:
+                return None
+
+            return pwfile_from_tuples(marshal.loads(f.read()))
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def load_validated(path, load, cache_path):
+    """returns the Pwfile loaded from path with load, or None, and the
+    error message of validate_pwfile. valid Pwfiles are cached at
+    cache_path, see above, and read from there while the file doesn't
+    change."""
+    if not pw.config.PWLIST_CACHE:
+        pws = load(path)
+        return pws, validate_pwfile(pws)
+
+    try:
+        key = cache_key(path)
+    except OSError:
+        key = None
+
+    if key:
+        pws = read_cache(cache_path, key)
+
+        if pws:
+            return pws, None
+
+    pws = load(path)
+    er = validate_pwfile(pws)
+
+    try:
+        # only cache what was loaded from the file as it was hashed
+        if key and not er and source_stat(path) == key[3:5]:
+            write_sidecar(cache_path, marshal.dumps(key) + marshal.dumps(pwfile_to_tuples(pws)))
+    except (OSError, ValueError):
+        pass
+
+    return pws, er
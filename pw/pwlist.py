@@ -1,26 +1,60 @@
 #!/usr/bin/env python3
 # pw_pwlist.py: pwlist2 and pwlist4 parsers and structures
 
+import io
 import os
-import appdirs
+import re
+import shutil
+import tempfile
+from array import array
 
+import pw.config
+from pw.domainindex import BLOCK_SIZE, load_domain_index, remove_domain_index, update_domain_index
+from pw.journal import append_changes, journal_path, journal_size, read_journal, replay
 from pw.transform import transformations
 from pw.sequence import Sequence, Segment, Param
-from pw.config import PROG, AUTHOR
 from pw.util import *
 
-localdir = appdirs.user_data_dir()
-datadir = appdirs.user_data_dir(PROG, AUTHOR)
+builtin_sequence_names = ["LEGACY1", "LEGACY2", "DEFAULT"]
+forbidden_name_symbols = [':', ';', ',', '<', '>', '[', ']']
 
-pwlist2_legacy_path = os.path.join(localdir, ".pwlist2")
-pwlist4_path = os.path.join(datadir, "pwlist4")
+# pwlist4 tokens
+forbidden_name_re = re.compile("[%s]" % re.escape("".join(forbidden_name_symbols)))
+space_re = re.compile(r"\s*")
+identifier_re = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+number_re = re.compile(r"\d+")
+string_re = re.compile(r'"([^"]*)"')
 
-parent = os.path.dirname(pwlist4_path)
-if not os.path.exists(parent):
-    os.makedirs(parent)
+# a user name in the common user entry "<user> - <sequence>", without
+# whitespace or forbidden symbols and not starting with "-". other user
+# entries are parsed by parse_pwlist4_user.
+user_name_pattern = r"([^\s\-:;,<>\[\]][^\s:;,<>\[\]]*)"
 
-builtin_sequence_names = ["LEGACY1", "LEGACY2", "DEFAULT"]
-forbidden_name_symbols = [':', ';', ',', '<', '>', '[', ']']
+# the start of the first line that isn't blank or indented, which ends
+# the users of a domain
+domain_end_re = re.compile(r"^(?![ \t]|[^\S\n]*$)", re.M)
+
+# one line of a pwlist4 file: a domain, a common user entry, a sequence
+# with its segments up to the next empty line, a blank line, a comment
+# or, if it's none of these, anything else
+line_re = re.compile(r"""
+    ([^\s\#\[:;,<>\]][^\n:;,<>\[\]]*):[^\S\n]*(?:\n|\Z)
+  | [ \t]+%s\ -\ %s[ \t]*(?:\n|\Z)
+  | (\[[^\n]*(?:\n[^\n]+)*)(?:\n|\Z)
+  | [^\S\n]*(?:\n|\Z)
+  | (\#)[^\n]*(?:\n|\Z)
+  | ([^\n]+)(?:\n|\Z)
+""" % (user_name_pattern, user_name_pattern), re.X)
+
+# characters read at a time by read_pwlist4
+CHUNK_SIZE = 1 << 20
+
+# characters written at a time by write_pwlist4
+WRITE_CHUNK_SIZE = 1 << 16
+
+# characters read at a time by load_pwlist4_domain, about a block of
+# domains, see pw/domainindex.py
+BLOCK_CHUNK_SIZE = 4096
 
 # structures
 class Pwfile():
@@ -28,6 +62,8 @@ class Pwfile():
         self.domains = {}
         self.sequences = {}
         self.default = "" # default sequence
+        self.changes = [] # since loaded or saved, see pw/journal.py
+        self.partial = False # only some domains were loaded
         
         legacy1 = Sequence()
         legacy1.name = "LEGACY1"
@@ -53,6 +89,51 @@ class Pwfile():
         else:
             return self.sequences.get(name)
         
+    def get_user(self, domain, user):
+        """returns the given user of the given domain or None"""
+        dom = self.domains.get(domain)
+        
+        if not dom:
+            return None
+        
+        return dom.users.get(user)
+    
+    def get_sequence_name(self, domain, user):
+        """returns the sequence name of the given user of the given domain,
+        or DEFAULT if there is no such user"""
+        usr = self.get_user(domain, user)
+        
+        if not usr:
+            return "DEFAULT"
+        
+        return usr.sequence
+    
+    def add_user(self, domain, user, seqname):
+        """adds or modifies a user, returns whether anything changed"""
+        usr = self.get_user(domain, user)
+        
+        if usr and usr.sequence == seqname:
+            return False
+        
+        dom = self.domains.get(domain)
+        
+        if not dom:
+            vprintf("adding new domain %s", domain)
+            self.domains[domain] = Domain(domain)
+            dom = self.domains[domain]
+        
+        usr = dom.users.get(user)
+        
+        if not usr:
+            vprintf("adding new user %s to domain %s", user, domain)
+            dom.users[user] = User(user)
+            usr = dom.users[user]
+        
+        vprintf("setting sequence of user %s of domain %s to %s", user, domain, seqname)
+        usr.sequence = seqname
+        self.changes.append(["user", domain, user, seqname])
+        return True
+    
     def rename_sequence(self, seqname, newname):
         seq = self.get_sequence(seqname)
         
@@ -76,6 +157,8 @@ class Pwfile():
                 if user.sequence == seqname:
                     user.sequence = newname
         
+        self.changes.append(["rename", seqname, newname])
+        
         
 class Domain():
     def __init__(self, name = ""):
@@ -154,376 +237,493 @@ def check_forbidden_symbol_in_name(name):
             raise ValueError("illegal symbol '" + sb + "' in name " + name)
 
 
-def parse_pwlist4_domain_name(line):
-    line = line.strip()
-    
-    if not line or not line.endswith(':'):
-        raise ValueError("domain name must end with :")
-    
-    check_forbidden_symbol_in_name(line[:-1])
-    
-    return line[:-1]
+def located(msg, line, column):
+    """an error at the given line and column of a pwlist4 file, counted from 1"""
+    return ValueError("%s in line %d, column %d" % (msg, line, column))
 
-    
-def parse_pwlist4_domain(lines, i):
-    ret = Domain()
-    
-    ret.name = parse_pwlist4_domain_name(lines[i])
-    
-    i += 1
-    
-    while i < len(lines):
-        line = lines[i]
-        
-        if not line.strip():
-            i += 1
-            continue
-        
-        if line.startswith("\t") or line.startswith(" "):
-            line = line.strip()
-            
-            if not line:
-                i += 1
-                continue
-            
-            if line.startswith('-'):
-                line = " " + line
-            parts = [p.strip() for p in line.split(" - ")]
-            
-            if len(parts) != 2:
-                raise ValueError("invalid user entry '%s' in domain '%s'" % (line, ret.name))
-            
-            usr, seq = parts
-            
-            check_forbidden_symbol_in_name(usr)
-            check_forbidden_symbol_in_name(seq)
-            
-            user = User()
-            user.name = usr
-            user.sequence = seq
-            
-            ret.users[usr] = user
-            i += 1
-            
-        else:
-            break
-        
-    return i, ret
 
+def check_name(name, line, column):
+    """check_forbidden_symbol_in_name for a name at the given line and
+    column of a pwlist4 file"""
+    if forbidden_name_re.search(name):
+        try:
+            check_forbidden_symbol_in_name(name)
+        except ValueError as e:
+            sb = str(e)[len("illegal symbol '")]
+            raise located(str(e), line, column + name.index(sb))
 
-def skip_whitespace(s, i):
-    while i < len(s) and str.isspace(s[i]):
-        i += 1
-    
-    return i
 
-        
-def parse_identifier(s, i):
-    """parses a identifier (name)"""
+def parse_pwlist4_domain_name(line, lineno = 0):
+    name = line.strip()
     
-    ret = ""
-    ls = len(s)
+    if not name or not name.endswith(':'):
+        raise located("domain name must end with :", lineno, 1)
     
-    if i >= ls:
-        raise ValueError("expected identifier in segment")
+    name = name[:-1]
+    check_name(name, lineno, len(line) - len(line.lstrip()) + 1)
+    
+    return name
 
-    c = s[i]
+
+def parse_pwlist4_user(line, lineno, domain_name):
+    """parses a user entry "<user> - <sequence>" of any form, see
+    user_name_pattern for the common one"""
+    column = len(line) - len(line.lstrip()) + 1
+    line = line.strip()
     
-    if c not in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_":
-        raise ValueError("unexpected symbol '%s' in identifier" % c)
+    if line.startswith('-'):
+        line = " " + line
+        column -= 1
     
-    ret += c
-    i += 1
+    parts = line.split(" - ")
     
-    while i < ls:
-        c = s[i]
-        
-        if c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_":
-            ret += c
-            i += 1
-            continue
-        else:
-            break
-        
-    return i, ret
-
-        
-def parse_string(s, i):
-    """parses a string in quotation marks " " """
+    if len(parts) != 2:
+        raise located("invalid user entry '%s' in domain '%s'" % (line, domain_name), lineno, column)
     
-    ret = ""
-    ls = len(s)
+    usr, seq = [p.strip() for p in parts]
+    check_name(usr, lineno, column + parts[0].index(usr) if usr else column)
+    check_name(seq, lineno, column + len(parts[0]) + 3 + parts[1].index(seq) if seq else column)
     
-    if i >= ls:
-        raise ValueError("expected identifier in segment")
+    return usr, seq
 
-    c = s[i]
     
-    if c != "\"":
-        raise ValueError("unexpected symbol '%s' in string" % c)
-    
-    i += 1
+def parse_pwlist4_domain(text, begin, end, lineno):
+    """parses the domain in text[begin:end], which starts at line lineno"""
+    ret = Domain()
+    i = text.find("\n", begin, end) + 1 or end
+    ret.name = parse_pwlist4_domain_name(text[begin:i], lineno)
     
-    while i < ls:
-        c = s[i]
+    # not splitlines, which also splits at e.g. form feeds
+    for line in text[i:end].split("\n"):
+        lineno += 1
         
-        if c == "\"":
-            break
-        else:
-            ret += c
-            i += 1
-            continue
-    
-    if i >= ls or s[i] != "\"":
-        raise ValueError("expected \" to terminate string")
-    
-    i += 1
+        if line.strip():
+            usr, seq = parse_pwlist4_user(line, lineno, ret.name)
+            ret.users[usr] = User(usr, seq)
         
-    return i, ret
+    return ret
 
-        
-def parse_number(s, i):
-    """parses an integer"""
+
+def segment_error(msg, s, i, line, column):
+    """an error at index i of segments starting at line and column"""
+    lines_before = s.count("\n", 0, i)
     
-    ret = ""
-    ls = len(s)
+    if lines_before:
+        column = i - s.rfind("\n", 0, i)
+    else:
+        column += i
     
-    if i >= ls:
-        raise ValueError("expected identifier in segment")
+    return located(msg, line + lines_before, column)
+
 
+def segment_string(value):
+    """the value of a string parameter as if its lines were stripped and
+    joined with spaces, the way sequences were always parsed"""
+    if "\n" not in value:
+        return value
+    
+    parts = value.split("\n")
+    parts = [parts[0].rstrip()] + [p.strip() for p in parts[1:-1]] + [parts[-1].lstrip()]
+    return " ".join(parts)
+
+
+def parse_param(s, i, line, column):
+    """parses a parameter at index i, which is not whitespace"""
     c = s[i]
     
-    if not str.isdigit(c):
-        raise ValueError("unexpected symbol '%s' in number" % c)
-    
-    ret += c
-    i += 1
-    
-    while i < ls:
-        c = s[i]
+    if c == "$":
+        m = identifier_re.match(s, i + 1)
         
-        if str.isdigit(c):
-            ret += c
-            i += 1
-            continue
-        else:
-            break
+        if not m:
+            if i + 1 >= len(s):
+                raise segment_error("expected identifier in segment", s, i + 1, line, column)
+            
+            raise segment_error("unexpected symbol '%s' in identifier" % s[i + 1], s, i + 1, line, column)
         
-    return i, int(ret)
-
-
-def parse_param(s, i):
-    """parses a parameter"""
+        return m.end(), Param("field", m.group())
     
-    ret = Param()
-    i = skip_whitespace(s, i)
-    ls = len(s)
-    
-    if i >= ls:
-        raise ValueError("expected symbol, got EOF in segment parameter")
-    
-    c = s[i]
+    if c.isdigit():
+        m = number_re.match(s, i)
+        
+        if not m:
+            raise segment_error("unexpected symbol '%s' in number" % c, s, i, line, column)
+        
+        return m.end(), Param("number", int(m.group()))
     
-    if c == "$":
-        i, ident = parse_identifier(s, i+1)
-        ret.typ = "field"
-        ret.value = ident
-    elif str.isdigit(c):
-        i, num = parse_number(s, i)
-        ret.typ = "number"
-        ret.value = num
-    else:
-        i, val = parse_string(s, i)
-        ret.typ = "string"
-        ret.value = val
+    m = string_re.match(s, i)
     
-    return i, ret
-
+    if not m:
+        if c != "\"":
+            raise segment_error("unexpected symbol '%s' in string" % c, s, i, line, column)
         
-def parse_params(s, i):
-    """parses arguments of a segment"""
+        raise segment_error("expected \" to terminate string", s, i, line, column)
     
+    return m.end(), Param("string", segment_string(m.group(1)))
+
+
+def parse_params(s, i, line, column):
+    """parses the arguments of a segment at index i"""
     ret = []
     ls = len(s)
     
-    i = skip_whitespace(s, i)
-       
     if i >= ls:
-        raise ValueError("expected symbol '(', got EOF in segment parameters")
+        raise segment_error("expected symbol '(', got EOF in segment parameters", s, i, line, column)
     
     if s[i] != "(":
-        raise ValueError("unexpected symbol '%s' in segment parameters" % (s[i]))
-        
-    i += 1
-
+        raise segment_error("unexpected symbol '%s' in segment parameters" % s[i], s, i, line, column)
+    
+    i = space_re.match(s, i + 1).end()
+    
     while i < ls:
-        c = s[i]
-        
-        if str.isspace(c):
-            i += 1
-            continue
+        if s[i] == ")":
+            return i + 1, ret
         
-        if c == ')':
-            break
-        
-        i, param = parse_param(s, i)
+        i, param = parse_param(s, i, line, column)
         ret.append(param)
+        i = space_re.match(s, i).end()
         
-        j = skip_whitespace(s, i)
-        
-        if j < ls:
-            if s[j] == ")":
-                continue
-            
-            if s[j] == ",":
-                i = j + 1
-                continue
-            
-            raise ValueError("expected ')' or ',', got '%s' in segment parameters" % s[j])
+        if i >= ls:
+            break
         
-    if i >= ls or s[i] != ")":
-        raise ValueError("expected symbol ')', got EOF in segment parameters")
+        if s[i] == ",":
+            i = space_re.match(s, i + 1).end()
+        elif s[i] != ")":
+            raise segment_error("expected ')' or ',', got '%s' in segment parameters" % s[i], s, i, line, column)
     
-    i += 1
-    
-    return i, ret
-        
+    raise segment_error("expected symbol ')', got EOF in segment parameters", s, i, line, column)
 
-def parse_segment(s, i):
-    """parses a single segment"""
-    
-    ret = Segment()
-    params = []
-    
-    i = skip_whitespace(s, i)
-    i, func = parse_identifier(s, i)
-    i, params = parse_params(s, i)
-    
-    ret.function = func
-    ret.parameters = params
-    
-    return i, ret
-    
 
-def parse_segments(s):
-    """parses sequence segments from a string"""
+def parse_segments(s, line = 1, column = 1):
+    """parses sequence segments from a string, which starts at the given
+    line and column of the file for error messages"""
     ret = []
+    ls = len(s)
+    i = space_re.match(s).end()
     
-    i = 0
-    while i < len(s):
-        c = s[i]
+    while i < ls:
+        m = identifier_re.match(s, i)
         
-        if str.isspace(c):
-            i += 1
-            continue
-    
-        i, seg = parse_segment(s, i)
+        if not m:
+            raise segment_error("unexpected symbol '%s' in identifier" % s[i], s, i, line, column)
         
+        seg = Segment()
+        seg.function = m.group()
+        i, seg.parameters = parse_params(s, space_re.match(s, m.end()).end(), line, column)
         ret.append(seg)
+        i = space_re.match(s, i).end()
         
     return ret
 
 
-def parse_pwlist4_sequence_name(line):
+def parse_pwlist4_sequence_name(line, lineno = 0):
     begin = line.find("[")
     end = line.find("]")
     
     if begin < 0:
-        raise ValueError("couldnt find symbol [ in sequence name")
+        raise located("couldnt find symbol [ in sequence name", lineno, 1)
     
     if end < 0:
-        raise ValueError("couldnt find symbol ] in sequence name")
+        raise located("couldnt find symbol ] in sequence name", lineno, len(line.rstrip("\n")) + 1)
     
     if end < begin:
-        raise ValueError("] must come after [ in sequence name")
+        raise located("] must come after [ in sequence name", lineno, end + 1)
     
     ret = line[begin+1:end]
-    check_forbidden_symbol_in_name(ret)
+    check_name(ret, lineno, begin + 2)
     
     return ret
     
     
-def parse_pwlist4_sequence(lines, i):
+def parse_pwlist4_sequence_block(header, segments, lineno):
+    """parses a sequence given its header line at lineno and the lines of
+    its segments"""
     ret = Sequence()
     
-    ret.name = parse_pwlist4_sequence_name(lines[i])
+    ret.name = parse_pwlist4_sequence_name(header, lineno)
     
     if ret.name.startswith("+"):
         ret.default = True
         ret.name = ret.name[1:]
         
         if not ret.name:
-            raise ValueError("sequence name cannot be empty")
-    
-    i += 1
-    j = i
+            raise located("sequence name cannot be empty", lineno, header.find("[") + 2)
     
-    while i < len(lines) and lines[i] != "\n" and lines[i] != "":
-        i += 1
-        
-    segstr = str.join(" ", [l.strip() for l in lines[j:i]])
-    ret.segments = parse_segments(segstr)
+    # segments may span lines
+    ret.segments = parse_segments(segments, lineno + 1)
     
-    return i, ret
-                
+    return ret
 
-def load_pwlist4(path):
-    """loads a pwlist4 file and returns a Pwfile structure"""
-    ret = Pwfile()
-    lines = readfile(path)
+
+def parse_pwlist4_sequence(lines, i):
+    """parses the sequence starting at lines[i], returns the index of the
+    line after it and the sequence"""
+    j = i + 1
     
-    if not lines:
-        return None
+    while j < len(lines) and lines[j] != "\n" and lines[j] != "":
+        j += 1
     
-    i = 0
+    return j, parse_pwlist4_sequence_block(lines[i], "".join(lines[i+1:j]), i + 1)
+
+
+def parse_pwlist4(text):
+    """parses the text of a pwlist4 file into a Pwfile. entries with
+    errors are skipped with a warning."""
+    return pwfile_from_records(parse_pwlist4_records(text))
+
+
+def parse_pwlist4_records(text, lineno = 1):
+    """returns the (line, record) of every domain and sequence in text,
+    which starts at line lineno of a pwlist4 file, in order"""
+    return parse_valid_pwlist4(text, lineno) or parse_pwlist4_lines(text, lineno)
+
+
+def parse_valid_pwlist4(text, lineno = 1):
+    """parses the text of a pwlist4 file in one findall, returns None if
+    it has any error, so parse_pwlist4_lines can report them"""
+    records = []
+    lines = array("L")
+    users = None
+    segment_lines = 0
+    
+    # every match is one line, but for sequences, which add the lines of
+    # their segments
+    for i, (name, usr, seq, sequence, comment, other) in enumerate(line_re.findall(text), lineno):
+        if usr:
+            if users is None:
+                return None
+            
+            users[usr] = User(usr, seq)
+            
+        elif name:
+            domain = Domain(name)
+            users = domain.users
+            records.append(domain)
+            lines.append(i + segment_lines)
+            
+        elif sequence:
+            header, _, segments = sequence.partition("\n")
+            
+            try:
+                i += segment_lines
+                records.append(parse_pwlist4_sequence_block(header, segments, i))
+                lines.append(i)
+            except ValueError:
+                return None
+            
+            segment_lines += sequence.count("\n")
+            users = None
+            
+        elif comment:
+            users = None
+            
+        elif other:
+            if users is None or other[0] not in " \t":
+                return None
+            
+            try:
+                usr, seq = parse_pwlist4_user(other, i + segment_lines, domain.name)
+            except ValueError:
+                return None
+            
+            users[usr] = User(usr, seq)
     
-    while i < len(lines):
-        line = lines[i]
-        
-        if not line.strip():
-            i += 1
+    # records are kept apart from their lines, a list of pairs would
+    # make the garbage collector run much more often
+    return zip(lines, records)
+
+
+def parse_pwlist4_lines(text, lineno = 1):
+    """parses the text of a pwlist4 file entry by entry, yields the
+    (line, record) of every domain and sequence and warns about errors"""
+    pos = 0
+    lt = len(text)
+    
+    while pos < lt:
+        eol = text.find("\n", pos) + 1 or lt
+        c = text[pos]
+        
+        if c == '#' or not text[pos:eol].strip():
+            # comment or blank line
+            pos = eol
+            lineno += 1
             continue
         
-        if line[0] == '#':
-            # comment
-            i += 1
-            continue
+        start = lineno
         
         try:
-            if line[0] == '[':
-                # sequence
-                i, seq = parse_pwlist4_sequence(lines, i)
-                
-                if seq.name in ret.sequences.keys():
-                    raise ValueError("duplicate sequence name '%s' in line %d" % (seq.name, i))
-                
-                if seq.default:
-                    if ret.default != "":
-                        raise ValueError("multiple default sequences not allowed: '%s' and '%s' are both marked default with '+'" % (seq.name, ret.default))
-                    else:
-                        ret.default = seq.name
+            if c == '[':
+                # sequence, up to the next empty line
+                end = text.find("\n\n", eol - 1) + 1 or lt
+                record = parse_pwlist4_sequence_block(text[pos:eol], text[eol:end], start)
                 
-                ret.sequences[seq.name] = seq
-                
-            elif line[0] != ' ' and line[0] != '\t':
-                i, domain = parse_pwlist4_domain(lines, i)
-                
-                if domain.name in ret.domains.keys():
-                    raise ValueError("duplicate domain name '%s' in line %d" % (domain.name, i))
-                
-                ret.domains[domain.name] = domain
+            elif c != ' ' and c != '\t':
+                m = domain_end_re.search(text, eol)
+                end = m.start() if m else lt
+                record = parse_pwlist4_domain(text, pos, end, start)
             
             else:
-                raise ValueError("unexpected symbol '%s' in line %d" % (line[0], i))
+                raise located("unexpected symbol '%s'" % c, start, 1)
             
         except ValueError as e:
-            if hasattr(e, "message"):
-                warn("%s", e.message)
-            else:
-                warn("%s", e)
+            warn_error(e)
+            
+            # skip the line the error was found in
+            pos = eol
+            lineno += 1
+            continue
+        
+        lineno += text.count("\n", pos, end)
+        pos = end
+        yield start, record
+
+
+def pwlist4_chunks(f, chunk_size = CHUNK_SIZE):
+    """yields (line, text) of pieces of about chunk_size characters of the
+    pwlist4 file f. pieces are only cut before a line that follows an
+    empty line and doesn't start with whitespace, which ends any domain
+    or sequence, so every entry is in one piece."""
+    lineno = 1
+    rest = ""
+    
+    while True:
+        data = f.read(chunk_size)
+        
+        if not data:
+            break
+        
+        text = rest + data
+        begin = max(len(rest) - 2, 0)
+        cut = text.rfind("\n\n", begin, len(text) - 1)
+        
+        while cut >= 0 and text[cut + 2].isspace():
+            cut = text.rfind("\n\n", begin, cut + 1)
+        
+        if cut < 0:
+            rest = text
+            continue
+        
+        rest = text[cut + 2:]
+        text = text[:cut + 2]
+        yield lineno, text
+        lineno += text.count("\n")
+    
+    if rest:
+        yield lineno, rest
+
+
+def read_pwlist4(f, chunk_size = CHUNK_SIZE):
+    """reads the pwlist4 file f incrementally, yields the (line, record)
+    of every domain and sequence and warns about entries with errors.
+    records are yielded as they're parsed, duplicates included, so files
+    can be scanned without loading them, see pwfile_from_records."""
+    for lineno, text in pwlist4_chunks(f, chunk_size):
+        yield from parse_pwlist4_records(text, lineno)
+
+
+def add_pwlist4_record(pws, lineno, record):
+    """adds a domain or sequence at line lineno of a pwlist4 file to pws"""
+    if isinstance(record, Domain):
+        if record.name in pws.domains.keys():
+            raise located("duplicate domain name '%s'" % record.name, lineno, 1)
+        
+        pws.domains[record.name] = record
+        return
+    
+    if record.name in pws.sequences.keys():
+        raise located("duplicate sequence name '%s'" % record.name, lineno, 1)
+    
+    if record.default:
+        if pws.default != "":
+            raise located("multiple default sequences not allowed: '%s' and '%s' are both marked default with '+'" % (record.name, pws.default), lineno, 1)
+        else:
+            pws.default = record.name
+    
+    pws.sequences[record.name] = record
+
+
+def pwfile_from_records(records):
+    """builds a Pwfile from (line, record) pairs, warns about and skips
+    duplicates"""
+    ret = Pwfile()
+    domains = ret.domains
+    
+    for lineno, record in records:
+        # the common case, inline
+        if type(record) is Domain and record.name not in domains:
+            domains[record.name] = record
+            continue
+        
+        try:
+            add_pwlist4_record(ret, lineno, record)
+        except ValueError as e:
+            warn_error(e)
+    
+    return ret
+
+
+def warn_error(e):
+    if hasattr(e, "message"):
+        warn("%s", e.message)
+    else:
+        warn("%s", e)
+
+
+def load_pwlist4(path):
+    """loads a pwlist4 file and returns a Pwfile structure"""
+    if not os.path.exists(path):
+        return None
+    
+    with open(path, mode='r') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        
+        ret = pwfile_from_records(read_pwlist4(f))
+    
+    add_fallback_sequence(ret)
+    replay(ret, read_journal(path))
+    return ret
+
+
+def load_pwlist4_domain(path, name):
+    """loads the sequences and only the domain name, if it exists, of a
+    pwlist4 file saved sorted. returns None if the file wasn't saved
+    sorted or was changed since."""
+    index = load_domain_index(path)
+    
+    if not index:
+        return None
+    
+    with open(path, mode='r') as f:
+        st = os.fstat(f.fileno())
+        
+        if (st.st_size, st.st_mtime_ns) != (index.size, index.mtime_ns):
+            return None
+        
+        f.seek(index.sequences)
+        ret = pwfile_from_records(read_pwlist4(f))
+        offset = index.block(name)
+        
+        if offset is not None:
+            f.seek(offset)
+            
+            # the block ends at the next domain after name or the sequences
+            for lineno, record in read_pwlist4(f, BLOCK_CHUNK_SIZE):
+                if not isinstance(record, Domain) or record.name > name:
+                    break
                 
-            i += 1
+                if record.name == name:
+                    ret.domains[name] = record
+                    break
     
+    add_fallback_sequence(ret)
+    replay(ret, read_journal(path), name)
+    ret.partial = True
+    return ret
+
+
+def add_fallback_sequence(ret):
+    """adds the good_password sequence to a loaded Pwfile if it has none
+    and makes it the default if there's no default"""
     # fallback, decent generator
     # technically not "built-in"
     if not ret.sequences.get("good_password"):
@@ -553,8 +753,6 @@ def load_pwlist4(path):
         
     if not ret.default:
         ret.default = "good_password"
-        
-    return ret
 
 
 def load_pwlist(path):
@@ -582,17 +780,16 @@ def segment_param_to_string(param):
         return "\"" + param.value + "\""
 
 
-def pwfile_to_string(pws):
-    """converts a Pwfile to pwlist4"""
-    s = ""
-    
-    for domain in pws.domains.values():
-        s += "\n\n" + domain.name + ":"
-        
-        for usr in domain.users.values():
-            s += "\n    " + usr.name + " - " + usr.sequence
+def pwlist4_domain_string(domain):
+    """converts a Domain to pwlist4, starting with an empty line"""
+    return "\n\n" + domain.name + ":" + "".join(["\n    " + usr.name + " - " + usr.sequence for usr in domain.users.values()])
 
 
+def pwlist4_sequences_string(pws):
+    """converts the sequences of a Pwfile to pwlist4, starting with an
+    empty line"""
+    s = ""
+    
     if pws.sequences:
         s += "\n\n# Sequences"
         s += "\n# don't change, only copy & make new ones to be safe,"
@@ -626,8 +823,64 @@ def pwfile_to_string(pws):
     return s
 
 
-def save_pwlist4(path, pws):
-    """saves a Pwfile structure to a given path as a pwlist4 file"""
+pwlist4_header = """# auto generated pwlist4 file containing sequences, domains and users.
+# feel free to edit / add but formatting and comments will be lost."""
+
+
+def write_pwlist4(f, pws, sort = False, header = pwlist4_header):
+    """writes a Pwfile as pwlist4 to the text file f, in chunks of about
+    WRITE_CHUNK_SIZE characters. if sort is true, the domains are written
+    sorted by name and the names and offsets of every BLOCK_SIZE-th domain
+    and the offset of the sequences are returned, see pw/domainindex.py."""
+    chunk = [header]
+    size = len(header)
+    names = []
+    offsets = []
+    domains = pws.domains.values()
+    
+    if sort:
+        domains = sorted(domains, key=lambda d: d.name)
+    
+    for i, domain in enumerate(domains):
+        if sort and i % BLOCK_SIZE == 0:
+            # offsets are only known for what was written
+            f.write("".join(chunk))
+            chunk.clear()
+            size = 0
+            names.append(domain.name)
+            offsets.append(f.tell())
+        
+        s = pwlist4_domain_string(domain)
+        chunk.append(s)
+        size += len(s)
+        
+        if size >= WRITE_CHUNK_SIZE:
+            f.write("".join(chunk))
+            chunk.clear()
+            size = 0
+    
+    f.write("".join(chunk))
+    sequences = f.tell() if sort else None
+    f.write(pwlist4_sequences_string(pws))
+    
+    if sort:
+        return names, offsets, sequences
+
+
+def pwfile_to_string(pws):
+    """converts a Pwfile to pwlist4"""
+    f = io.StringIO()
+    write_pwlist4(f, pws, header="")
+    return f.getvalue()
+
+
+def save_pwlist4(path, pws, sort = None, fsync = None):
+    """saves a Pwfile structure to a given path as a pwlist4 file. the
+    file is written next to it and renamed over it, so it's never left
+    half written, and flushed to disk if fsync is true. if sort is true,
+    the domains are written sorted by name along with a domain index, see
+    load_pwlist4_domain. sort and fsync default to pw.config.SORTED_PWLIST
+    and pw.config.FSYNC_PWLIST."""
     if not pws or not pws.domains:
         vprintf("nothing to export")
         
@@ -635,14 +888,102 @@ def save_pwlist4(path, pws):
     if parent and parent != "." and not os.path.exists(parent):
         os.makedirs(parent)
     
-    # domains
-    s = """# auto generated pwlist4 file containing sequences, domains and users.
-# feel free to edit / add but formatting and comments will be lost."""
-
-    s += pwfile_to_string(pws)
+    if sort is None:
+        sort = pw.config.SORTED_PWLIST
+    
+    if fsync is None:
+        fsync = pw.config.FSYNC_PWLIST
+    
+    # replace the file a symlink points to, not the symlink
+    target = os.path.realpath(path)
+    
+    # a unique name, so concurrent saves don't write the same file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix=os.path.basename(target) + ".")
+    
+    try:
+        with os.fdopen(fd, mode='w') as f:
+            index = write_pwlist4(f, pws, sort)
             
-    with open(path, mode='w') as f:
-        f.write(s)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        
+        if os.path.exists(target):
+            shutil.copymode(target, tmp)
+        
+        os.replace(tmp, target)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        
+        raise
+    
+    if fsync:
+        sync_dir(os.path.dirname(target))
+    
+    remove_journal(path)
+    
+    if sort:
+        update_domain_index(path, *index)
+    else:
+        remove_domain_index(path)
+
+
+def sync_dir(path):
+    """flushes the entries of the directory at path to disk, where the
+    system allows it"""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def remove_journal(path):
+    """removes the journal of the pwlist4 file at path, which was just
+    saved in full"""
+    try:
+        os.remove(journal_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def save_changes(path, pws):
+    """saves the changes to pws since it was loaded or saved, returns
+    whether there were any. they are appended to the journal of the
+    pwlist4 file at path, which is compacted into the file once it's
+    larger than pw.config.JOURNAL_LIMIT bytes."""
+    if not pws.changes:
+        return False
+    
+    if not os.path.exists(path):
+        save_pwlist4(path, pws)
+    else:
+        journal_changes(path, pws.changes)
+    
+    pws.changes = []
+    return True
+
+
+def journal_changes(path, changes):
+    """appends changes to the journal of the existing pwlist4 file at
+    path, see save_changes"""
+    append_changes(path, changes)
+    
+    if journal_size(path) > pw.config.JOURNAL_LIMIT:
+        vprintf("compacting '%s'", path)
+        
+        # other processes may have journaled changes since the changes
+        # were made, so the whole journal is replayed on top of the file
+        save_pwlist4(path, load_pwlist4(path))
 
 
 def validate_pwfile(pws):
@@ -669,7 +1010,7 @@ def validate_pwfile(pws):
                     return "user " + usr.name + " of domain " + domain.name + " contains forbidden symbol '" + fs + "'"
             
             if not (usr.sequence in seq_names):
-                return "user " + usr.name + " of domain " + domain + " uses unknown sequence " + usr.sequence
+                return "user " + usr.name + " of domain " + domain.name + " uses unknown sequence " + usr.sequence
     
     for seq in pws.sequences.values():
         for fs in forbidden_name_symbols:
@@ -1,8 +1,61 @@
 #!/usr/bin/env python3
 # pw_sequence 
 
+import os
+from collections import deque
+
 from pw.transform import transformations
 from pw.util import *
+import pw.config
+
+# edits of any sequence, segment or parameter so far. compiled plans
+# remember the count they were built at and are rebuilt once it changed,
+# see compile_sequence. checking a single counter is cheaper than
+# comparing the sequence with what the plan was built from on every call.
+edits = 0
+
+def edited():
+    global edits
+    edits += 1
+
+
+class EditList(list):
+    """a list that counts its changes as edits"""
+    def __setitem__(self, i, value):
+        edited()
+        super().__setitem__(i, value)
+    
+    def __delitem__(self, i):
+        edited()
+        super().__delitem__(i)
+    
+    def __iadd__(self, other):
+        edited()
+        return super().__iadd__(other)
+    
+    def __imul__(self, n):
+        edited()
+        return super().__imul__(n)
+    
+    def __reduce__(self):
+        # restored as a plain list by pickle, __setattr__ wraps it again
+        return (list, (list(self),))
+
+
+def edit_method(name):
+    method = getattr(list, name)
+    
+    def edit(self, *args, **kwargs):
+        edited()
+        return method(self, *args, **kwargs)
+    
+    edit.__name__ = name
+    return edit
+
+
+for name in ["append", "extend", "insert", "pop", "remove", "clear", "sort", "reverse"]:
+    setattr(EditList, name, edit_method(name))
+
 
 class Sequence():
     def __init__(self, name = ""):
@@ -10,17 +63,48 @@ class Sequence():
         self.segments = []
         self.default = False
     
+    def __setattr__(self, name, value):
+        if name == "segments":
+            value = EditList(value)
+            edited()
+        
+        object.__setattr__(self, name, value)
+    
     def __eq__(self, other):
         return self.segments == other.segments
+    
+    def __getstate__(self):
+        # compiled plans hold functions that can't be pickled or copied,
+        # they are rebuilt on first use
+        state = dict(self.__dict__)
+        state.pop("_plan", None)
+        state.pop("_plan_edits", None)
+        state.pop("_plan_optimize", None)
+        return state
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
 
 class Segment():
     def __init__(self, function = ""):
         self.function = function
         self.parameters = []
+    
+    def __setattr__(self, name, value):
+        if name == "parameters":
+            value = EditList(value)
+        
+        edited()
+        object.__setattr__(self, name, value)
         
     def __eq__(self, other):
         return (self.function == other.function) and (self.parameters == other.parameters)
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
         
 
 # types: field, number, string
@@ -28,6 +112,10 @@ class Param():
     def __init__(self, typ="", value=None):
         self.typ = typ
         self.value = value
+    
+    def __setattr__(self, name, value):
+        edited()
+        object.__setattr__(self, name, value)
         
     def __eq__(self, other):
         return (self.typ == other.typ) and (self.value == other.value)
@@ -47,9 +135,48 @@ def param_value(param, key, domain, user):
         return param.value
 
 
-def execute_sequence(seq, key, domain, user):
-    """executes the given sequence object with the parameters provided"""
-    ret = ""
+field_slots = {"key": 0, "domain": 1, "user": 2}
+
+class SequencePlan():
+    """a sequence with resolved transformation functions and bound
+    parameters, ready to be executed"""
+    def __init__(self, steps, gives = "any"):
+        # list of (function, arguments, field slots). arguments holds the
+        # constant parameters, field slots (argument index, field index)
+        # pairs for parameters that are filled in per call.
+        self.steps = steps
+        # representation of the value the last step returns
+        self.gives = gives
+        
+    def __call__(self, key, domain, user):
+        fields = (key, domain, user)
+        ret = ""
+        
+        for func, args, slots in self.steps:
+            if slots:
+                args = list(args)
+                
+                for i, field in slots:
+                    args[i] = fields[field]
+            
+            ret = func(ret, *args)
+        
+        if self.gives == "str":
+            return ret
+        
+        if isinstance(ret, bytes):
+            ret = ret.decode()
+        elif isinstance(ret, int):
+            ret = str(int)
+        
+        return ret
+
+
+def build_plan(seq, optimize = False):
+    steps = []
+    # values start out as "" and stay in the representation the previous
+    # step returns, only the end result is converted to str
+    current = "str"
     
     for seg in seq.segments:
         func = transformations.get(seg.function)
@@ -60,12 +187,179 @@ def execute_sequence(seq, key, domain, user):
         if func.params != len(seg.parameters):
             raise ValueError("function %s expects %d parameters, %d given" % (seg.function, func.params, len(seg.parameters)))
         
-        param_values = [param_value(p, key, domain, user) for p in seg.parameters]
-        ret = func(ret, *param_values)
+        args = []
+        slots = []
+        
+        for i, p in enumerate(seg.parameters):
+            if p.typ == "field":
+                if p.value not in field_slots:
+                    raise ValueError("unknown field '$%s'" % p.value)
+                
+                slots.append((i, field_slots[p.value]))
+                args.append(None)
+            else:
+                args.append(p.value)
+        
+        if func.native and current == func.takes:
+            steps.append((func.native, tuple(args), tuple(slots)))
+        else:
+            steps.append((func.function, tuple(args), tuple(slots)))
+        
+        current = func.gives
+    
+    plan = SequencePlan(steps, current)
+    
+    if not optimize:
+        return plan
+    
+    from pw.optimize import optimize_steps, verify_plans
+    
+    opt_steps, changed = optimize_steps(steps)
+    
+    if not changed:
+        return plan
+    
+    optimized = SequencePlan(opt_steps, current)
+    
+    if not verify_plans(plan, optimized):
+        vprintf("optimized sequence %s differs from the original, not optimizing", seq.name)
+        return plan
+    
+    return optimized
+
+
+def compile_sequence(seq, optimize = False):
+    """returns the execution plan of the given sequence object. plans are
+    cached on the sequence and rebuilt when any sequence was edited
+    since, see edits. optimizing pays off only for plans that are run
+    many times, callers doing so pass pw.config.OPTIMIZE_SEQUENCES."""
+    plan = seq.__dict__.get("_plan")
+    
+    if plan is None or seq._plan_edits != edits or seq._plan_optimize != optimize:
+        plan = build_plan(seq, optimize)
+        seq._plan = plan
+        seq._plan_edits = edits
+        seq._plan_optimize = optimize
+    
+    return plan
+
+
+def execute_sequence(seq, key, domain, user, optimize = False):
+    """executes the given sequence object with the parameters provided"""
+    return compile_sequence(seq, optimize)(key, domain, user)
+
+
+# batch generation
+GENERATE_CHUNK_SIZE = 256
+
+def resolve_chunks(pwfile, pairs, sequence, chunksize):
+    """splits (domain, user) pairs into lists of (sequence name, domain,
+    user), resolving the sequence of every pair the same way the command
+    line does"""
+    chunk = []
+    
+    for domain, user in pairs:
+        seqname = sequence or pwfile.get_sequence_name(domain, user)
+        seq = pwfile.get_sequence(seqname)
+        
+        if not seq:
+            raise ValueError("sequence '%s' not found" % seqname)
+        
+        chunk.append((seq.name, domain, user))
+        
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    
+    if chunk:
+        yield chunk
+
+
+def generate_chunk(sequences, key, chunk):
+    optimize = pw.config.OPTIMIZE_SEQUENCES
+    plans = {seqname: compile_sequence(sequences[seqname], optimize) for seqname in {seqname for seqname, domain, user in chunk}}
+    return [plans[seqname](key, domain, user) for seqname, domain, user in chunk]
+
+
+# state of process pool workers, set once per worker by init_worker so
+# the key and sequences are not sent along with every chunk
+worker_state = None
+
+def init_worker(sequences, key):
+    global worker_state
+    worker_state = (sequences, key)
+
+
+def generate_chunk_in_worker(chunk):
+    sequences, key = worker_state
+    return generate_chunk(sequences, key, chunk)
+
+
+def make_executor(backend, workers, sequences, key):
+    """returns an executor and a function submitting a chunk to it"""
+    if backend == "thread":
+        from concurrent.futures import ThreadPoolExecutor
+        
+        executor = ThreadPoolExecutor(workers)
+        return executor, lambda chunk: executor.submit(generate_chunk, sequences, key, chunk)
     
-    if isinstance(ret, bytes):
-        ret = ret.decode()
-    elif isinstance(ret, int):
-        ret = str(int)
+    if backend == "process":
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        # forked workers inherit the imported modules, i.e. the wordlist,
+        # instead of importing them again
+        context = None
+        
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        
+        executor = ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(sequences, key))
+        return executor, lambda chunk: executor.submit(generate_chunk_in_worker, chunk)
+    
+    raise ValueError("unknown backend '%s'" % backend)
+
+
+def generate_many(pwfile, key, pairs, backend = "inline", sequence = None, workers = None, chunksize = GENERATE_CHUNK_SIZE):
+    """generates passwords for many (domain, user) pairs of the given
+    pwfile and yields (domain, user, password) in input order.
+    backend is one of inline, thread or process. pairs may be any
+    iterable, it is consumed in chunks and only a few chunks per worker
+    are in flight at any time. sequence overrides the sequences of the
+    users like -s does."""
+    chunks = resolve_chunks(pwfile, pairs, sequence, chunksize)
+    
+    if backend == "inline":
+        for chunk in chunks:
+            for (seqname, domain, user), pw in zip(chunk, generate_chunk(pwfile.sequences, key, chunk)):
+                yield domain, user, pw
+        return
+    
+    workers = workers or os.cpu_count() or 1
+    executor, submit = make_executor(backend, workers, pwfile.sequences, key)
+    pending = deque()
     
-    return ret
+    try:
+        for chunk in chunks:
+            pending.append((chunk, submit(chunk)))
+            
+            # results are yielded in order, so the oldest chunk is waited
+            # for once enough work is queued to keep every worker busy
+            if len(pending) < 2 * workers:
+                continue
+            
+            chunk, future = pending.popleft()
+            
+            for (seqname, domain, user), pw in zip(chunk, future.result()):
+                yield domain, user, pw
+        
+        while pending:
+            chunk, future = pending.popleft()
+            
+            for (seqname, domain, user), pw in zip(chunk, future.result()):
+                yield domain, user, pw
+    finally:
+        for chunk, future in pending:
+            future.cancel()
+        
+        executor.shutdown()
@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 # pw_transform.py: transformation functions
-import base58 as b58
 import base64 as b64
 import hashlib
 import random
 import math
-import inspect
+import threading
+from collections import OrderedDict
 
-from pw.wordlist import wordlist
+from pw.hashing import PrefixHasher, prefix_digests
 from pw.util import *
+import pw.config
 
 def to_string(s):
     """attempts to convert an arbitrary object to str"""
@@ -26,7 +27,7 @@ def base58(s):
     if isinstance(s, str):
         s = s.encode()
     
-    return b58.b58encode(s)
+    return base58_bytes(s)
 
 def base64(s):
     """converts the input to base64"""
@@ -56,10 +57,127 @@ def to_int(s):
     
     return int.from_bytes(s, "little")
     
+thread_state = threading.local()
+
+def seeded_random(s):
+    """returns a private random generator seeded with the input.
+    unlike random.seed, this does not touch the module-global generator,
+    so concurrent sequences cannot interfere with each other.
+    every thread reuses its own generator, so it is only valid until the
+    next call in the same thread."""
+    rng = getattr(thread_state, "rng", None)
+    
+    if rng is None:
+        rng = thread_state.rng = random.Random()
+    
+    if type(s) is int:
+        # random.Random.seed hands ints to the C implementation unchanged,
+        # skip its python level version dispatch
+        super(random.Random, rng).seed(s)
+    else:
+        rng.seed(s)
+        
+    return rng
+
+class SeedCache():
+    """bounded LRU cache for seed results.
+    entries are keyed on a digest of the input, never on the input itself,
+    because inputs contain the key."""
+    def __init__(self, maxsize = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key):
+        """returns the cached value of key or None"""
+        with self._lock:
+            val = self._entries.get(key)
+            
+            if val is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return val
+        
+    def put(self, key, value):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            
+            entries = self._entries
+            entries[key] = value
+            entries.move_to_end(key)
+            
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                
+    def resize(self, maxsize):
+        """sets the maximum number of entries, 0 disables caching"""
+        with self._lock:
+            self.maxsize = maxsize
+            
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+        
+    def clear(self):
+        """removes all entries and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+seed_cache = SeedCache(pw.config.SEED_CACHE_SIZE)
+
+def seed_key(s):
+    """returns the digest to cache the input s by and the value to seed a
+    generator with, or None if s can't be cached"""
+    if isinstance(s, str):
+        s = s.encode()
+    
+    if isinstance(s, (bytes, bytearray)):
+        # same as random.seed(s) with version 2, but we keep the sha512
+        # to use it as cache key
+        digest = hashlib.sha512(s).digest()
+        return ("b", digest), int.from_bytes(s + digest, "big")
+    
+    if isinstance(s, int):
+        b = s.to_bytes((s.bit_length() + 8) // 8, "little", signed=True)
+        return ("i", hashlib.sha512(b).digest()), s
+    
+    return None, s
+
+def seed_prefixed(hasher, suffix, min_int = 0, max_int = 2**32-1):
+    """same as seed(prefix + suffix, min_int, max_int) for a PrefixHasher
+    with sha512 that already has been fed the prefix. not cached, inputs
+    that are built up piece by piece rarely come up twice."""
+    digest = hasher.digest("sha512", suffix)
+    
+    # same as random.seed(prefix + suffix) with version 2
+    return seeded_random(hasher.to_int(suffix + digest)).randint(min_int, max_int)
+
 def seed(s, min_int = 0, max_int = 2**32-1):
     """gets a deterministic seed in the given range from the input"""
-    random.seed(s)
-    return random.randint(min_int, max_int)
+    key, s = seed_key(s)
+    
+    if key is None or seed_cache.maxsize <= 0:
+        return seeded_random(s).randint(min_int, max_int)
+    
+    key = key + (min_int, max_int)
+    ret = seed_cache.get(key)
+    
+    if ret is None:
+        ret = seeded_random(s).randint(min_int, max_int)
+        seed_cache.put(key, ret)
+        
+    return ret
 
 def append(s, s2):
     """appends the parameter to the input at the end"""
@@ -149,10 +267,64 @@ def make_unambiguous(s):
     unsafe_characters = "ZlLtTiIjJoO012"
     
     for unsafe in unsafe_characters:
+        # nothing to replace, the seed would be wasted
+        if unsafe not in s:
+            continue
+        
         s = s.replace(unsafe, safe_characters[seed(s + unsafe, 0, ls)])
     
     return s
 
+class InsertionBuffer():
+    """text that single characters get inserted into at increasing positions.
+    everything up to and including the last inserted character can't change
+    anymore, so it is kept in a PrefixHasher and only the remaining tail is
+    kept as str."""
+    def __init__(self, s):
+        self.head = None    # PrefixHasher of the text up to the last insertion
+        self.head_len = 0   # length of head in characters
+        self.tail = s
+        
+    def sha256(self, suffix):
+        """sha256(text + suffix)"""
+        tail = (self.tail + suffix).encode()
+        
+        if self.head is None:
+            return hashlib.sha256(tail).digest()
+        
+        return self.head.digest("sha256", tail)
+    
+    def seed(self, suffix, min_int, max_int):
+        """seed(text + suffix, min_int, max_int)"""
+        tail = self.tail + suffix
+        
+        if self.head is None:
+            return seed(tail, min_int, max_int)
+        
+        return seed_prefixed(self.head, tail.encode(), min_int, max_int)
+    
+    def insert(self, index, c):
+        """inserts c at index, which must not be before the last insertion"""
+        index = min(max(index - self.head_len, 0), len(self.tail))
+        
+        # only the first inserted character is final, the next insertion
+        # may go right after it
+        piece = self.tail[:index] + c[:1]
+        self.tail = c[1:] + self.tail[index:]
+        self.head_len += len(piece)
+        
+        if self.head is None:
+            self.head = PrefixHasher(piece.encode())
+        else:
+            self.head.extend(piece.encode())
+        
+    def __str__(self):
+        if self.head is None:
+            return self.tail
+        
+        return self.head.prefix.decode() + self.tail
+        
+
 def add_special_characters(s, min_count, max_count, special_chars):
     """adds characters to the input"""
     s = to_string(s)
@@ -166,28 +338,28 @@ def add_special_characters(s, min_count, max_count, special_chars):
     ls = len(s)
     num_chars = min(seed(s, min_count, max_count), ls)
     
-    if num_chars == 0:
+    if num_chars <= 0:
         return s
     
     lsc = len(special_chars)-1
     
     dst = ls // num_chars
     pos = 0
+    buf = InsertionBuffer(s)
     
     for i in range(0, num_chars):
-        tmp = s + str(i)
-        hsh = sha256(tmp)
+        hsh = buf.sha256(str(i))
         
         schar_seed = seed(hsh, 0, lsc)
         schar = special_chars[schar_seed]
         
-        ipos = seed(tmp, pos, pos + dst)
-        s = s[:ipos] + schar + s[ipos:]
+        ipos = buf.seed(str(i), pos, pos + dst)
+        buf.insert(ipos, schar)
         pos += dst + 1
         
-    return s
-        
+    return str(buf)
         
+
 def add_simple_special_characters(s, min_count, max_count):
     """adds a predefined set of special characters to the input"""
     return add_special_characters(s, min_count, max_count, "#+*%&[]=?_.:")
@@ -221,9 +393,11 @@ def capitalize_some(s):
         # nothing to capitalize
         return s
     
-    num_words = seed(s, 1, lw)
+    # the word count and the sample have to come from the same generator
+    rng = seeded_random(s)
+    num_words = rng.randint(1, lw)
     
-    rwords = random.sample(words, num_words)
+    rwords = rng.sample(words, num_words)
     
     for rword in rwords:
         i = s.find(rword)
@@ -236,17 +410,26 @@ def capitalize_some(s):
     return s
 
 
-def diceware_list(s, min_count, max_count, words = wordlist):
+def default_wordlist():
+    """the diceware wordlist, imported on first use"""
+    from pw.wordlist import wordlist
+    return wordlist
+
+
+def diceware_list(s, min_count, max_count, words = None):
     """generate word sequences of the given wordlist using the input as seed"""
     s = to_string(s)
+    
+    if words is None:
+        words = default_wordlist()
         
     num_words = seed(s, min_count, max_count)
     
     l = []
     lwl = len(words)-1
+    hashes = prefix_digests("sha256", s.encode(), [str(i).encode() for i in range(0, num_words)])
     
-    for i in range(0, num_words):
-        hsh = sha256(s + str(i))
+    for hsh in hashes:
         l.append(words[seed(hsh, 0, lwl)])
         
     return str.join(' ', l)
@@ -254,7 +437,12 @@ def diceware_list(s, min_count, max_count, words = wordlist):
 
 def diceware(s, min_count, max_count):
     """generate word sequences of the default wordlist using the input as seed"""
-    return diceware_list(s, min_count, max_count, wordlist)
+    return diceware_list(s, min_count, max_count)
+
+def diceware_file(s, wordlist, min_count, max_count):
+    """generate word sequences of a registered wordlist ("name" or "name@fingerprint") using the input as seed"""
+    from pw.wordlists import get_wordlist
+    return diceware_list(s, min_count, max_count, get_wordlist(wordlist))
 
 def diceware_short(s):
     """generates 3 to 4 diceware words from the input"""
@@ -268,17 +456,16 @@ def diceware_long(s):
 ####################
 #      LEGACY      #
 ####################
+easy_to_read_table = str.maketrans("iIl10Oo", "uPhT4ry")
+
 def bad_make_easy_to_read(s):
     """DO NOT USE. arbitrary bad replacement"""
     s = to_string(s)
-        
-    s = replace(s, "i", "u")
-    s = replace(s, "I", "P")
-    s = replace(s, "l", "h")
-    s = replace(s, "1", "T")
-    s = replace(s, "0", "4")
-    s = replace(s, "O", "r")
-    s = replace(s, "o", "y")
+    
+    # i -> u, I -> P, l -> h, 1 -> T, 0 -> 4, O -> r, o -> y, one after
+    # the other. none of the replacements get replaced again, so a single
+    # translation does the same.
+    s = s.translate(easy_to_read_table)
     s = replace(s, "vv", "nW")
     s = replace(s, "VV", "K3")
     return s
@@ -362,25 +549,26 @@ def bad_legacy2(ret, key, domain, user):
 # transform segment functions
 # name: param count
 class Transformation():
-    def __init__(self, func):
-        self.params = len(inspect.signature(func).parameters) - 1
+    def __init__(self, func, takes = "any", gives = "any", native = None):
+        # all parameters are positional, the first one is the input
+        self.params = func.__code__.co_argcount - 1
         self.function = func
+        # representation ("str", "bytes", "int" or "any") of the input the
+        # transformation works on and of the value it returns. native is
+        # an equivalent function that only accepts input in the "takes"
+        # representation, used by compiled sequences when the previous
+        # step is known to return that.
+        self.takes = takes
+        self.gives = gives
+        self.native = native
         
     def __call__(self, *args):
         return self.function(*args)
     
     def get_doc(self):
-        prms_ = inspect.signature(self.function).parameters
-        prms = []
-        
-        i = False
-        for p in prms_:
-            if not i:
-                i = True
-                continue
-            
-            prms.append(p)
-            
+        code = self.function.__code__
+        prms = code.co_varnames[1:code.co_argcount]
+        
         doc = self.function.__name__
         
         doc += "("
@@ -392,7 +580,40 @@ class Transformation():
         return doc
         
         
+# native versions of the transformations that work on bytes
+def base58_bytes(s):
+    # only sequences using base58 need the codec
+    from pw.b58 import b58encode
+    return b58encode(s)
+
+def base64_bytes(s):
+    return b64.b64encode(s)
+
+def sha256_bytes(s):
+    return hashlib.sha256(s).digest()
+
+def sha512_bytes(s):
+    return hashlib.sha512(s).digest()
+
+def to_int_bytes(s):
+    return int.from_bytes(s, "little")
+
+
+# function: (takes, gives, native)
+value_representations = {
+    base58: ("bytes", "bytes", base58_bytes),
+    base64: ("bytes", "bytes", base64_bytes),
+    sha256: ("bytes", "bytes", sha256_bytes),
+    sha512: ("bytes", "bytes", sha512_bytes),
+    to_int: ("bytes", "int", to_int_bytes),
+    seed: ("any", "int", None),
+    # replace only returns if its input was a str
+    replace: ("str", "str", None),
+}
+
 transformations = {}
 
-for func in [base58, base64, sha256, sha512, to_int, seed, append, prepend, init, cut, limit, replace, replace_at, insert, make_unambiguous, add_special_characters, add_simple_special_characters, add_some_special_characters, add_some_simple_special_characters, capitalize_some, diceware, diceware_short, diceware_long, bad_legacy1, bad_legacy2]:
-    transformations[func.__name__] = Transformation(func)
+for func in [base58, base64, sha256, sha512, to_int, seed, append, prepend, init, cut, limit, replace, replace_at, insert, make_unambiguous, add_special_characters, add_simple_special_characters, add_some_special_characters, add_some_simple_special_characters, capitalize_some, diceware, diceware_file, diceware_short, diceware_long, bad_legacy1, bad_legacy2]:
+    # everything else converts its input with to_string
+    takes, gives, native = value_representations.get(func, ("any", "str", None))
+    transformations[func.__name__] = Transformation(func, takes, gives, native)
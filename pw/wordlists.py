@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# pw_wordlists.py: external wordlists for diceware_file
+#
+# wordlists are text files with one word per line, lines starting with #
+# are comments, same as pw/wordlist.txt. they are registered by name,
+# either one by one or all .txt files of a directory, named after the
+# file without extension. the wordlists directory in the pw-py data
+# directory is registered on first use.
+#
+# every list is validated and packed once per process and reloaded when
+# its file changes. lists are identified across machines by their
+# fingerprint, the sha256 of the packed words: diceware_file accepts
+# "name@fingerprint" (or any prefix of the fingerprint) and fails
+# instead of generating different passwords if the list doesn't match.
+
+import hashlib
+import os
+import threading
+
+from pw.wordlist import PackedWordlist, read_words, pack_words
+
+# a list needs at least this many words
+MIN_WORDS = 2
+
+registered = {} # name -> path
+loaded = {} # name -> (path, stat key, fingerprint, PackedWordlist)
+lock = threading.Lock()
+default_dir_registered = False
+
+def register_wordlist(name, path):
+    """registers the wordlist file at path as name"""
+    check_wordlist_name(name)
+
+    with lock:
+        registered[name] = os.path.abspath(path)
+
+
+def register_wordlist_dir(path):
+    """registers all .txt files in the directory at path, named after the
+    file without extension"""
+    for fname in sorted(os.listdir(path)):
+        name, ext = os.path.splitext(fname)
+
+        if ext == ".txt" and os.path.isfile(os.path.join(path, fname)):
+            register_wordlist(name, os.path.join(path, fname))
+
+
+def register_default_dir():
+    global default_dir_registered
+
+    if default_dir_registered:
+        return
+
+    default_dir_registered = True
+
+    from pw.paths import wordlists_dir
+    path = wordlists_dir()
+
+    if os.path.isdir(path):
+        for fname in sorted(os.listdir(path)):
+            name, ext = os.path.splitext(fname)
+
+            # explicitly registered lists take precedence
+            if ext == ".txt" and name not in registered:
+                register_wordlist(name, os.path.join(path, fname))
+
+
+def check_wordlist_name(name):
+    if not name or "@" in name or os.sep in name:
+        raise ValueError("invalid wordlist name '%s'" % name)
+
+
+def validate_words(words, path):
+    if len(words) < MIN_WORDS:
+        raise ValueError("wordlist %s has less than %d words" % (path, MIN_WORDS))
+
+    seen = set()
+
+    for i, w in enumerate(words):
+        if any(c.isspace() for c in w):
+            raise ValueError("wordlist %s: word %d '%s' contains whitespace" % (path, i + 1, w))
+
+        if w in seen:
+            raise ValueError("wordlist %s: duplicate word '%s'" % (path, w))
+
+        seen.add(w)
+
+
+def load_wordlist(name):
+    """returns (fingerprint, PackedWordlist) of a registered wordlist,
+    reading the file only if it changed since it was last read"""
+    register_default_dir()
+    path = registered.get(name)
+
+    if not path:
+        raise ValueError("wordlist '%s' not registered" % name)
+
+    st = os.stat(path)
+    stat_key = (st.st_mtime_ns, st.st_size)
+    entry = loaded.get(name)
+
+    if entry and entry[0] == path and entry[1] == stat_key:
+        return entry[2], entry[3]
+
+    with lock:
+        words = read_words(path)
+        validate_words(words, path)
+        packed = pack_words(words)
+        fingerprint = hashlib.sha256(packed).hexdigest()
+        loaded[name] = (path, stat_key, fingerprint, PackedWordlist(None, packed))
+        return fingerprint, loaded[name][3]
+
+
+def get_wordlist(spec):
+    """returns the wordlist given as "name" or "name@fingerprint", where
+    fingerprint may be shortened"""
+    name, sep, expected = spec.partition("@")
+    fingerprint, words = load_wordlist(name)
+
+    if sep and not (expected and fingerprint.startswith(expected.lower())):
+        raise ValueError("wordlist '%s' has fingerprint %s, expected %s" % (name, fingerprint, expected))
+
+    return words
+
+
+def wordlist_fingerprint(name):
+    return load_wordlist(name)[0]
+
+
+def registered_wordlists():
+    """returns the names of all registered wordlists"""
+    register_default_dir()
+    return sorted(registered.keys())
@@ -24,16 +24,17 @@ setup_info = dict(
 
     # Package info
     packages=['pw'] + ['pw.' + pkg for pkg in find_packages('pw')],
+    package_data={'pw': ['wordlist.bin', 'wordlist.txt']},
     entry_points={'console_scripts': [PROG + "=pw.__main__:__main__"]},
     
     # requirements
     install_requires=[
         'clipboard>=0.0.4',
-        'appdirs>=1.4.4',
-        'base58>=2.1.1'
+        'appdirs>=1.4.4'
     ],
 
-    zip_safe=True,
+    # wordlist.bin is memory mapped and has to be a real file
+    zip_safe=False,
 )
 
 setup(**setup_info)
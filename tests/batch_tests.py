@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# batch tests:
+# generating passwords for json records with --batch
+
+import io
+import json
+import os
+import sys
+import tempfile
+
+import pw.__main__ as pm
+import pw.pwlist as pp
+from pw.sequence import execute_sequence
+
+def assertEqual(expected, actual):
+    if expected != actual:
+        raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
+
+pwlist = """[+seq]
+    init($key, $domain, $user)
+    sha512()
+    base64()
+    cut(0, 12)
+
+[bad]
+    init($key, $domain, $user)
+    sha256()
+    replace("a", "b")
+
+a.com:
+    alice - LEGACY1
+"""
+
+class BrokenOutput(io.StringIO):
+    """fails to write after the first line"""
+    def write(self, s):
+        if self.getvalue():
+            raise BrokenPipeError("broken pipe")
+
+        return super().write(s)
+
+def run_batch(path, records, output = None):
+    """runs --batch on path with the given lines, returns the exit code,
+    the results and the number of saves"""
+    saves = []
+    save_changes = pp.save_changes
+    pp.save_changes = lambda *args: saves.append(args) or save_changes(*args)
+    read_key = pm.read_key
+    pm.read_key = lambda: "key"
+    stdin = sys.stdin
+    sys.stdin = io.StringIO("".join(line + "\n" for line in records))
+    pm.out = output or io.StringIO()
+
+    try:
+        ret = pm.main(pm.get_argument_parser().parse_args(["--batch", "-f", path]))
+    finally:
+        pp.save_changes = save_changes
+        pm.read_key = read_key
+        sys.stdin = stdin
+
+    results = [json.loads(line) for line in pm.out.getvalue().splitlines()]
+    pm.out = sys.stdout
+    return ret, results, len(saves)
+
+def batch_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+
+        with open(path, "w") as f:
+            f.write(pwlist)
+
+        pws = pp.load_pwlist4(path)
+        ret, results, saves = run_batch(path, [
+            '{"domain": "a.com", "user": "alice"}',
+            '{"domain": "b.com", "user": "bob"}',
+            '{"domain": "c.com", "user": "carol", "sequence": "bad"}',
+            '{"domain": "d:com", "user": "dave"}',
+            '{"domain": "e.com", "user": "erin", "sequence": "missing"}',
+            'not json',
+            '',
+            '{"domain": "f.com", "user": "frank", "sequence": "LEGACY2"}',
+        ])
+
+        assertEqual(1, ret)
+        assertEqual(1, saves)
+        assertEqual(7, len(results))
+
+        # results, in the order of the records
+        assertEqual({"domain": "a.com", "user": "alice", "sequence": "LEGACY1",
+                     "password": execute_sequence(pws.sequences["LEGACY1"], "key", "a.com", "alice")}, results[0])
+        assertEqual({"domain": "b.com", "user": "bob", "sequence": "seq",
+                     "password": execute_sequence(pws.sequences["seq"], "key", "b.com", "bob")}, results[1])
+        assertEqual("LEGACY2", results[6]["sequence"])
+
+        # error records, a sequence failing at runtime doesn't stop the batch
+        assertEqual(["c.com", "d:com", "e.com"], [r["domain"] for r in results[2:5]])
+        assertEqual([False, False, True, True, True, True, False], ["error" in r for r in results])
+        assertEqual(True, "password" not in results[2])
+        assertEqual("illegal symbol ':' in name d:com", results[3]["error"])
+        assertEqual("sequence 'missing' not found", results[4]["error"])
+
+        # only the users that got a password are saved
+        domains = pp.load_pwlist4(path).domains
+        assertEqual(["a.com", "b.com", "f.com"], sorted(domains))
+        assertEqual("seq", domains["b.com"].users["bob"].sequence)
+
+        # the users of the passwords written before a failure are saved
+        try:
+            run_batch(path, ['{"domain": "g.com", "user": "grace"}', '{"domain": "h.com", "user": "heidi"}'], BrokenOutput())
+        except BrokenPipeError:
+            pass
+        else:
+            raise AssertionError("expected BrokenPipeError")
+
+        domains = pp.load_pwlist4(path).domains
+        assertEqual(True, "g.com" in domains and "h.com" not in domains)
+
+def run_tests():
+    batch_test()
+
+    print("%s: all tests passed" % __file__)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# client tests:
+# pooled and pipelined requests to the daemon and in-process fallback
+
+import asyncio
+import os
+import tempfile
+import threading
+
+import pw.client as pc
+import pw.daemon as pd
+import pw.protocol as pp
+from pw.pwlist import Pwfile, Domain, User, load_pwlist4, save_changes, save_pwlist4
+from pw.sequence import execute_sequence
+
+def assertEqual(expected, actual):
+    if expected != actual:
+        raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
+
+def assertRaises(exc, f, *args):
+    try:
+        f(*args)
+    except exc:
+        return
+
+    raise AssertionError("assertion failed: %s not raised" % exc.__name__)
+
+def make_pwfile():
+    pws = Pwfile()
+    pws.default = "LEGACY2"
+    pws.domains["a.com"] = Domain("a.com")
+    pws.domains["a.com"].users["alice"] = User("alice", "LEGACY1")
+    return pws
+
+class DaemonThread(threading.Thread):
+    def __init__(self, pws, fp, path):
+        super().__init__()
+        self.daemon_ = pd.Daemon(pws, fp, 2)
+        self.path = path
+        self.started = threading.Event()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop = asyncio.Event()
+        server = await pd.start_server(self.daemon_, self.path)
+        self.started.set()
+        await self.stop.wait()
+        server.close()
+        self.daemon_.close()
+
+    def __enter__(self):
+        self.start()
+        self.started.wait()
+        return self
+
+    def __exit__(self, *args):
+        self.loop.call_soon_threadsafe(self.stop.set)
+        self.join()
+
+def expected_passwords(pws, pairs):
+    ret = []
+
+    for domain, user in pairs:
+        seq = pws.get_sequence(pws.get_sequence_name(domain, user))
+        ret.append((domain, user, execute_sequence(seq, "k", domain, user)))
+
+    return ret
+
+pairs = [("a.com", "alice")] + [("d%d.com" % i, "u%d" % i) for i in range(300)]
+
+def client_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pw.sock")
+        fp = os.path.join(d, "pwlist4")
+        expected = expected_passwords(make_pwfile(), pairs)
+
+        with DaemonThread(make_pwfile(), fp, path):
+            with pc.Client(path, pool_size=2, window=16, fallback=False) as client:
+                assertEqual(["a.com"], client.list())
+                assertEqual(["alice"], client.complete("al", "a.com"))
+                assertEqual(expected[0][2], client.generate("k", "a.com", "alice"))
+
+                # connections are reused
+                conn = client.pool.queue[-1]
+                assertEqual(1, client.pool.qsize())
+                client.list()
+                assertEqual(True, conn is client.pool.queue[-1])
+
+                # more requests than the window on one connection
+                assertEqual(expected, list(client.generate_many("k", iter(pairs))))
+                assertEqual(1, client.pool.qsize())
+
+                assertRaises(ValueError, client.generate, "k", "a.com", "alice", "nope")
+
+                # an abandoned pipeline does not leave responses on a pooled connection
+                stream = client.generate_many("k", pairs)
+                next(stream)
+                stream.close()
+                assertEqual(expected[0][2], client.generate("k", "a.com", "alice"))
+
+                # responses are matched by id
+                conn = pc.Connection(path)
+                first = conn.send({"op": "list"})
+                second = conn.send({"op": "complete", "prefix": "a"})
+                assertEqual(["a.com"], conn.receive(second)["result"])
+                assertEqual(first, conn.receive(first)["id"])
+                conn.close()
+
+        assertEqual(True, load_pwlist4(fp).get_user("d5.com", "u5") is not None)
+
+        assertRaises(ConnectionError, pc.Client(path, fallback=False).list)
+
+def paging_test():
+    pws = make_pwfile()
+
+    for i in range(100):
+        pws.domains["d%03d.com" % i] = Domain("d%03d.com" % i)
+
+    page_size = pp.PAGE_SIZE
+    pp.PAGE_SIZE = 200
+
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "pw.sock")
+
+            with DaemonThread(pws, os.path.join(d, "pwlist4"), path):
+                with pc.Client(path, fallback=False) as client:
+                    assertEqual(list(pws.domains.keys()), client.list())
+                    assertEqual(["d%03d.com" % i for i in range(100)], client.complete("d"))
+    finally:
+        pp.PAGE_SIZE = page_size
+
+def fallback_test():
+    with tempfile.TemporaryDirectory() as d:
+        fp = os.path.join(d, "pwlist4")
+        save_pwlist4(fp, make_pwfile())
+        expected = expected_passwords(load_pwlist4(fp), pairs)
+
+        client = pc.Client(os.path.join(d, "pw.sock"), fp=fp)
+        assertEqual(expected, list(client.generate_many("k", pairs)))
+        assertEqual(["alice"], client.complete("a", "a.com"))
+        assertRaises(ValueError, client.generate, "k", "a.com", "alice", "nope")
+
+        # saved once the requests are done
+        assertEqual(True, load_pwlist4(fp).get_user("d5.com", "u5") is not None)
+
+def fallback_refresh_test():
+    with tempfile.TemporaryDirectory() as d:
+        fp = os.path.join(d, "pwlist4")
+        save_pwlist4(fp, make_pwfile())
+
+        with pc.Client(os.path.join(d, "pw.sock"), fp=fp) as client:
+            client.generate("k", "b.com", "bob")
+
+            # another process saves a user while the client is in use
+            other = load_pwlist4(fp)
+            other.add_user("a.com", "xavier", "LEGACY1")
+            save_changes(fp, other)
+
+            expected = execute_sequence(other.get_sequence("LEGACY1"), "k", "a.com", "xavier")
+            assertEqual(expected, client.generate("k", "a.com", "xavier"))
+            assertEqual(["alice", "xavier"], client.list("a.com"))
+
+        pws = load_pwlist4(fp)
+        assertEqual("LEGACY1", pws.get_user("a.com", "xavier").sequence)
+        assertEqual(True, pws.get_user("b.com", "bob") is not None)
+
+def run_tests():
+    client_test()
+    paging_test()
+    fallback_test()
+    fallback_refresh_test()
+
+    print("%s: all tests passed" % __file__)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# completion tests:
+# the completion and trigram indexes used by pw -l
+
+import os
+import tempfile
+
+import pw.completion as pcm
+import pw.fuzzy as pfz
+from pw.pwlist import Pwfile, Domain, User, save_pwlist4
+
+def assertEqual(expected, actual):
+    if expected != actual:
+        raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
+
+def make_pwfile(domains):
+    pws = Pwfile()
+
+    for name, users in domains.items():
+        pws.domains[name] = Domain(name)
+
+        for user in users:
+            pws.domains[name].users[user] = User(user, "DEFAULT")
+
+    return pws
+
+domains = {
+    "b.com": ["bob"],
+    "a.com": ["alice", "al", "zed"],
+    "ab.org": ["x"],
+    "abc.net": [],
+    "": ["nodomain"],
+}
+
+def complete_test():
+    index = pcm.CompletionIndex(pcm.build_index(make_pwfile(domains)))
+
+    assertEqual(["", "a.com", "ab.org", "abc.net", "b.com"], index.complete())
+    assertEqual(["ab.org", "abc.net"], index.complete("", "ab"))
+    assertEqual(["ab.org"], index.complete("", "ab", 1))
+    assertEqual([], index.complete("", "ab", 0))
+    assertEqual([], index.complete("", "c"))
+    assertEqual(["al", "alice", "zed"], index.complete("a.com"))
+    assertEqual(["al", "alice"], index.complete("a.com", "al"))
+    assertEqual(["x"], index.complete("ab.org"))
+    assertEqual([], index.complete("ab"))
+    assertEqual([], index.complete("abc.net"))
+
+def update_index_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        pws = make_pwfile(domains)
+
+        assertEqual(None, pcm.load_index(path))
+        assertEqual(["b.com"], pcm.update_index(path, pws).complete("", "b"))
+        assertEqual(False, os.path.exists(pcm.index_path(path)))
+
+        save_pwlist4(path, pws)
+        assertEqual(None, pcm.load_index(path))
+        pcm.update_index(path, pws)
+        assertEqual(["bob"], pcm.load_index(path).complete("b.com"))
+
+        # out of date once the pwlist file changes
+        pws.domains["c.com"] = Domain("c.com")
+        save_pwlist4(path, pws)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assertEqual(None, pcm.load_index(path))
+        assertEqual(["c.com"], pcm.update_index(path, pws).complete("", "c"))
+        assertEqual(["c.com"], pcm.load_index(path).complete("", "c"))
+
+        # broken indexes are rebuilt
+        with open(pcm.index_path(path), "wb") as f:
+            f.write(b"PWCI")
+
+        assertEqual(None, pcm.load_index(path))
+
+def fuzzy_test():
+    names = dict(domains)
+    names.update({"github.com": ["aesncast"], "gitlab.com": [], "example.com": [], "example.org": []})
+    names.update({"d%d.net" % i: [] for i in range(2000)})
+    index = pcm.CompletionIndex(pcm.build_index(make_pwfile(names)))
+    fuzzy = pfz.FuzzyIndex(pfz.build_trigrams(index), index)
+
+    assertEqual(1.0, pfz.similarity(pfz.trigrams("GitHub.com"), pfz.trigrams("github.com")))
+    assertEqual("github.com", fuzzy.suggest_domains("githb.com")[0])
+    assertEqual(["example.com", "example.org"], fuzzy.suggest_domains("exmaple", 2))
+    assertEqual(["github.com", "gitlab.com"], fuzzy.suggest_domains("git", 10, 0.2))
+    assertEqual([], fuzzy.suggest_domains("zzz"))
+    assertEqual([""], fuzzy.suggest_domains("", 1))
+
+    # the common trigrams of .net don't hide the others
+    assertEqual("d1234.net", fuzzy.suggest_domains("d1234.nett")[0])
+
+    assertEqual(["alice", "al"], fuzzy.suggest_users("a.com", "alic", 2))
+    assertEqual(["alice"], fuzzy.suggest_users("a.com", "alic", 10, pfz.SUGGEST_SIMILARITY))
+    assertEqual([], fuzzy.suggest_users("x.com", "alice"))
+
+def fuzzy_index_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        pws = make_pwfile(domains)
+        save_pwlist4(path, pws)
+        index = pcm.update_index(path, pws)
+
+        assertEqual(None, pfz.load_fuzzy_index(path, index))
+        assertEqual(["b.com"], pfz.fuzzy_index(path, index).suggest_domains("b.cm", 1))
+        assertEqual(["b.com"], pfz.load_fuzzy_index(path, index).suggest_domains("b.cm", 1))
+
+        # out of date with the completion index
+        pws.domains["c.com"] = Domain("c.com")
+        save_pwlist4(path, pws)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        index = pcm.update_index(path, pws)
+        assertEqual(None, pfz.load_fuzzy_index(path, index))
+        assertEqual(["c.com"], pfz.fuzzy_index(path, index).suggest_domains("c.cm", 1))
+
+def run_tests():
+    complete_test()
+    update_index_test()
+    fuzzy_test()
+    fuzzy_index_test()
+
+    print("%s: all tests passed" % __file__)
+
+if __name__ == "__main__":
+    run_tests()
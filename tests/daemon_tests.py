@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# daemon tests:
+# talking to the generation daemon over a unix domain socket
+
+import asyncio
+import json
+import os
+import stat
+import tempfile
+import threading
+
+import pw.config
+import pw.daemon as pd
+import pw.protocol as pp
+from pw.pwlist import Pwfile, Domain, User, load_pwlist4, save_changes, save_pwlist4
+from pw.sequence import execute_sequence
+
+def assertEqual(expected, actual):
+    if expected != actual:
+        raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
+
+def make_pwfile():
+    pws = Pwfile()
+    pws.default = "LEGACY2"
+    pws.domains["a.com"] = Domain("a.com")
+    pws.domains["a.com"].users["alice"] = User("alice", "LEGACY1")
+    pws.domains["a.com"].users["bob"] = User("bob", "LEGACY2")
+    pws.domains["b.com"] = Domain("b.com")
+    return pws
+
+async def request(reader, writer, req):
+    writer.write(pd.encode_frame(req))
+    return json.loads((await pd.read_frame(reader)).decode())
+
+async def talk(path, fp):
+    pws = make_pwfile()
+    daemon = pd.Daemon(pws, fp, 2)
+    server = await pd.start_server(daemon, path)
+
+    assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+
+        ret = await request(reader, writer, {"id": 1, "op": "list"})
+        assertEqual({"id": 1, "result": ["a.com", "b.com"]}, ret)
+
+        ret = await request(reader, writer, {"id": 2, "op": "complete", "domain": "a.com", "prefix": "a"})
+        assertEqual({"id": 2, "result": ["alice"]}, ret)
+
+        ret = await request(reader, writer, {"id": 3, "op": "generate", "key": "k", "domain": "a.com", "user": "alice"})
+        expected = execute_sequence(pws.get_sequence("LEGACY1"), "k", "a.com", "alice")
+        assertEqual({"domain": "a.com", "user": "alice", "sequence": "LEGACY1", "password": expected}, ret["result"])
+
+        ret = await request(reader, writer, {"id": 4, "op": "generate", "key": "k", "domain": "c.com", "user": "carol"})
+        expected = execute_sequence(pws.get_sequence("LEGACY2"), "k", "c.com", "carol")
+        assertEqual(expected, ret["result"]["password"])
+        assertEqual("LEGACY2", pws.get_user("c.com", "carol").sequence)
+
+        # errors are reported per request
+        ret = await request(reader, writer, {"id": 5, "op": "nope"})
+        assertEqual({"id": 5, "error": "unknown op 'nope'"}, ret)
+
+        ret = await request(reader, writer, {"id": 6, "op": "generate", "key": "k", "sequence": "nope"})
+        assertEqual({"id": 6, "error": "sequence 'nope' not found"}, ret)
+
+        writer.write(pd.header.pack(3) + b"{{{")
+        ret = json.loads((await pd.read_frame(reader)).decode())
+        assertEqual(True, "error" in ret)
+
+        # a second daemon can't take over the socket
+        try:
+            await pd.start_server(pd.Daemon(pws, fp), path)
+            raise AssertionError("second daemon started")
+        except ValueError:
+            pass
+
+        writer.close()
+    finally:
+        server.close()
+        daemon.close()
+
+    assertEqual("LEGACY2", load_pwlist4(fp).get_user("c.com", "carol").sequence)
+
+def daemon_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pw.sock")
+        asyncio.run(talk(path, os.path.join(d, "pwlist4")))
+
+        # the socket of a daemon that is gone is replaced
+        asyncio.run(talk(path, os.path.join(d, "pwlist4")))
+
+async def talk_paged(path, fp):
+    pws = make_pwfile()
+
+    for i in range(100):
+        pws.domains["d%03d.com" % i] = Domain("d%03d.com" % i)
+
+    daemon = pd.Daemon(pws, fp, 2)
+    server = await pd.start_server(daemon, path)
+    saved_in = []
+    journal_changes = pd.journal_changes
+    pd.journal_changes = lambda *args: saved_in.append(threading.current_thread()) or journal_changes(*args)
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+        names = []
+        offset = 0
+
+        # list and complete are paged to PAGE_SIZE
+        while offset is not None:
+            ret = await request(reader, writer, {"id": 1, "op": "list", "offset": offset})
+            assertEqual(True, len(json.dumps(ret["result"])) <= pp.PAGE_SIZE)
+            names += ret["result"]
+            offset = ret.get("next")
+
+        assertEqual(list(pws.domains.keys()), names)
+
+        ret = await request(reader, writer, {"id": 2, "op": "complete", "prefix": "d"})
+        assertEqual(["d000.com", "d001.com"], ret["result"][:2])
+        assertEqual(len(ret["result"]), ret["next"])
+
+        ret = await request(reader, writer, {"id": 2, "op": "complete", "prefix": "d09"})
+        assertEqual(["d09%d.com" % i for i in range(10)], ret["result"])
+        assertEqual(False, "next" in ret)
+
+        ret = await request(reader, writer, {"id": 3, "op": "list", "offset": -1})
+        assertEqual(True, "error" in ret)
+
+        # other responses too large for a frame are errors
+        max_frame_size = pd.MAX_FRAME_SIZE
+        pd.MAX_FRAME_SIZE = 64
+
+        try:
+            ret = await request(reader, writer, {"id": 4, "op": "generate", "key": "k", "domain": "a.com", "user": "alice"})
+        finally:
+            pd.MAX_FRAME_SIZE = max_frame_size
+
+        assertEqual(4, ret["id"])
+        assertEqual(True, ret["error"].startswith("response too large"))
+
+        # saving doesn't block the event loop
+        await request(reader, writer, {"id": 5, "op": "generate", "key": "k", "domain": "e.com", "user": "eve"})
+        daemon.save()
+        writer.close()
+    finally:
+        server.close()
+        daemon.close()
+        pd.journal_changes = journal_changes
+
+    assertEqual(1, len(saved_in))
+    assertEqual(True, saved_in[0] is not threading.main_thread())
+    assertEqual("LEGACY2", load_pwlist4(fp).get_user("e.com", "eve").sequence)
+
+def paging_test():
+    page_size = pp.PAGE_SIZE
+    pp.PAGE_SIZE = 200
+
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            fp = os.path.join(d, "pwlist4")
+            save_pwlist4(fp, make_pwfile())
+            asyncio.run(talk_paged(os.path.join(d, "pw.sock"), fp))
+    finally:
+        pp.PAGE_SIZE = page_size
+
+async def talk_refreshed(path, fp):
+    save_pwlist4(fp, make_pwfile())
+    daemon = pd.Daemon(load_pwlist4(fp), fp, 2)
+    server = await pd.start_server(daemon, path)
+    limit = pw.config.JOURNAL_LIMIT
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+
+        # another process saves a user while the daemon is running
+        other = load_pwlist4(fp)
+        other.add_user("a.com", "xavier", "LEGACY1")
+        save_changes(fp, other)
+
+        ret = await request(reader, writer, {"id": 1, "op": "generate", "key": "k", "domain": "a.com", "user": "xavier"})
+        assertEqual("LEGACY1", ret["result"]["sequence"])
+        assertEqual(execute_sequence(other.get_sequence("LEGACY1"), "k", "a.com", "xavier"), ret["result"]["password"])
+
+        ret = await request(reader, writer, {"id": 2, "op": "list", "domain": "a.com"})
+        assertEqual(["alice", "bob", "xavier"], ret["result"])
+
+        # and compacts the journal into the file
+        other.add_user("b.com", "yvonne", "LEGACY1")
+        pw.config.JOURNAL_LIMIT = 0
+
+        try:
+            save_changes(fp, other)
+        finally:
+            pw.config.JOURNAL_LIMIT = limit
+
+        ret = await request(reader, writer, {"id": 3, "op": "generate", "key": "k", "domain": "b.com", "user": "yvonne"})
+        assertEqual("LEGACY1", ret["result"]["sequence"])
+
+        # users the daemon records itself stay while it follows the file
+        ret = await request(reader, writer, {"id": 4, "op": "generate", "key": "k", "domain": "c.com", "user": "zoe"})
+        other.add_user("c.com", "walter", "LEGACY1")
+        save_changes(fp, other)
+        ret = await request(reader, writer, {"id": 5, "op": "list", "domain": "c.com"})
+        assertEqual(["zoe", "walter"], ret["result"])
+        writer.close()
+    finally:
+        server.close()
+        daemon.close()
+
+    pws = load_pwlist4(fp)
+    assertEqual("LEGACY1", pws.get_user("a.com", "xavier").sequence)
+    assertEqual("LEGACY1", pws.get_user("b.com", "yvonne").sequence)
+    assertEqual("good_password", pws.get_user("c.com", "zoe").sequence)
+    assertEqual("LEGACY1", pws.get_user("c.com", "walter").sequence)
+
+def refresh_test():
+    with tempfile.TemporaryDirectory() as d:
+        asyncio.run(talk_refreshed(os.path.join(d, "pw.sock"), os.path.join(d, "pwlist4")))
+
+def run_tests():
+    daemon_test()
+    refresh_test()
+    paging_test()
+
+    print("%s: all tests passed" % __file__)
+
+if __name__ == "__main__":
+    run_tests()
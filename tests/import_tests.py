@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# import tests:
+# startup cost of the command line paths, measured with python -X importtime.
+# every path has a list of modules it must not import and a budget for
+# the total import time, which can be scaled for slow machines with
+# PW_IMPORT_BUDGET_SCALE.
+
+import os
+import subprocess
+import sys
+import tempfile
+
+from pw.pwlist import Pwfile, Domain, User, save_pwlist4
+
+# milliseconds
+LIST_BUDGET = 120
+INDEX_BUDGET = 60
+GENERATE_BUDGET = 250
+
+def assertEqual(expected, actual):
+    if expected != actual:
+        raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
+
+def budget(ms):
+    return ms * float(os.environ.get("PW_IMPORT_BUDGET_SCALE", "1"))
+
+def import_times(args, stdin = ""):
+    """runs pw-py with the given arguments and returns the imported
+    modules with their own import time in milliseconds"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([os.getcwd()] + sys.path)
+
+    # without a controlling terminal getpass reads the key from stdin
+    p = subprocess.run([sys.executable, "-X", "importtime", "-m", "pw"] + args, input=stdin, env=env,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, start_new_session=True)
+    assertEqual(0, p.returncode)
+
+    ret = {}
+
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        ret[name.strip()] = int(self_us) / 1000
+
+    return ret, p.stdout
+
+def check_path(args, stdin, budget_ms, forbidden):
+    times, out = import_times(args, stdin)
+
+    for module in forbidden:
+        if module in times:
+            raise AssertionError("%s imports %s" % (" ".join(args), module))
+
+    total = sum(times.values())
+
+    if total > budget(budget_ms):
+        slowest = sorted(times.items(), key=lambda x: -x[1])[:10]
+        raise AssertionError("%s: imports took %.1f ms, budget is %.1f ms, slowest: %s" % (" ".join(args), total, budget(budget_ms), slowest))
+
+    return out
+
+def make_pwfile(path):
+    pws = Pwfile()
+    pws.domains["a.com"] = Domain("a.com")
+    pws.domains["a.com"].users["alice"] = User("alice", "good_password")
+    save_pwlist4(path, pws)
+
+def list_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        make_pwfile(path)
+
+        out = check_path(["-l", "-f", path], "", LIST_BUDGET,
+                         ["clipboard", "appdirs", "inspect", "json", "getpass", "pw.b58", "asyncio"])
+        assertEqual("a.com\n", out)
+
+        # with an up to date completion index the pwlist file isn't parsed
+        out = check_path(["-l", "-f", path, "a.com"], "", INDEX_BUDGET,
+                         ["pw.pwlist", "pw.transform", "pw.sequence", "clipboard", "appdirs", "json", "getpass", "asyncio"])
+        assertEqual("alice\n", out)
+
+def generate_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        make_pwfile(path)
+
+        out = check_path(["--batch", "-f", path], 'key\n{"domain": "a.com", "user": "alice"}\n', GENERATE_BUDGET,
+                         ["clipboard", "appdirs", "inspect", "pw.b58", "asyncio"])
+        assertEqual(True, '"password"' in out)
+
+def run_tests():
+    list_test()
+    generate_test()
+
+    print("%s: all tests passed" % __file__)
+
+if __name__ == "__main__":
+    run_tests()
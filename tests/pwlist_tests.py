@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# pwlist tests:
+# parsing pwlist4 files
+
+import io
+import os
+import tempfile
+
+import pw.config
+import pw.journal
+import pw.pwlist as pp
+from pw.completion import source_stat
+from pw.pwcache import load_validated
+from pw.sequence import Param
+
+def assertEqual(expected, actual):
+    if expected != actual:
+        raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
+
+def summary(pws):
+    return (pws.default,
+            [(d.name, [(u.name, u.sequence) for u in d.users.values()]) for d in pws.domains.values()],
+            [(s.name, [(g.function, [(p.typ, p.value) for p in g.parameters]) for g in s.segments]) for s in pws.sequences.values()])
+
+def parse(text):
+    """returns the parsed Pwfile and the warnings"""
+    warnings = []
+    warn = pp.warn
+    pp.warn = lambda fmt, *args: warnings.append(fmt % args)
+
+    try:
+        return pp.parse_pwlist4(text), warnings
+    finally:
+        pp.warn = warn
+
+valid = """# comment
+[+seq]
+    init($key, $domain,
+         $user)
+    cut(0, 12) replace("a  b", "c")
+    append("multi
+           line")
+
+a.com:
+    alice - seq
+
+    bob - LEGACY1
+b.org :
+    john doe - seq
+    -x - seq
+    y - -z
+"""
+
+def parse_test():
+    pws, warnings = parse(valid)
+    assertEqual([], warnings)
+    assertEqual("seq", pws.default)
+    assertEqual([("a.com", [("alice", "seq"), ("bob", "LEGACY1")]), ("b.org ", [("john doe", "seq"), ("-x", "seq"), ("y", "-z")])], summary(pws)[1])
+
+    seq = pws.sequences["seq"]
+    assertEqual(["init", "cut", "replace", "append"], [g.function for g in seq.segments])
+    assertEqual([Param("field", "key"), Param("field", "domain"), Param("field", "user")], seq.segments[0].parameters)
+    assertEqual([Param("number", 0), Param("number", 12)], seq.segments[1].parameters)
+    assertEqual([Param("string", "a  b"), Param("string", "c")], seq.segments[2].parameters)
+    # strings spanning lines are joined with a single space
+    assertEqual([Param("string", "multi line")], seq.segments[3].parameters)
+
+    # the line by line parser gives the same result
+    assertEqual(summary(pws), summary(pp.pwfile_from_records(pp.parse_pwlist4_lines(valid))))
+
+def error_test():
+    text = "a.com:\n    alice - seq\n    bad entry\n\n[s]\n    init($key,\n      $x, 1 2)\n\n[t]\n    f(\"abc\n\nc:d:\n"
+    pws, warnings = parse(text)
+
+    assertEqual([
+        "invalid user entry 'bad entry' in domain 'a.com' in line 3, column 5",
+        "unexpected symbol ' ' in line 2, column 1",
+        "unexpected symbol ' ' in line 3, column 1",
+        "expected ')' or ',', got '2' in segment parameters in line 7, column 13",
+        "unexpected symbol ' ' in line 6, column 1",
+        "unexpected symbol ' ' in line 7, column 1",
+        "expected \" to terminate string in line 10, column 7",
+        "unexpected symbol ' ' in line 10, column 1",
+        "illegal symbol ':' in name c:d in line 12, column 2",
+    ], warnings)
+    assertEqual([], list(pws.domains.keys()))
+    assertEqual(False, "s" in pws.sequences)
+
+    pws, warnings = parse("a.com:\n    x - y\na.com:\n    z - y\n")
+    assertEqual(["duplicate domain name 'a.com' in line 3, column 1"], warnings)
+    assertEqual([("a.com", [("x", "y")])], summary(pws)[1])
+
+    pws, warnings = parse("[s]\n\n[s]\n    init()\n")
+    assertEqual(["duplicate sequence name 's' in line 3, column 1"], warnings)
+    assertEqual([], pws.sequences["s"].segments)
+
+    # only the duplicate is skipped
+    pws, warnings = parse("a.com:\n    x - y\na.com:\n    z - y\nb.com:\n    z - y\n")
+    assertEqual(["duplicate domain name 'a.com' in line 3, column 1"], warnings)
+    assertEqual(["a.com", "b.com"], list(pws.domains.keys()))
+
+def read_test():
+    text = valid + "\nc.net:\n    carol - seq\n\n# end\n[t]\n    init($user)\n\nd.net:\n"
+    expected = summary(parse(text)[0])
+
+    # pieces are only cut between entries
+    for chunk_size in [1, 2, 5, 16, 1000]:
+        records = list(pp.read_pwlist4(io.StringIO(text), chunk_size))
+        assertEqual([(2, "seq"), (9, "a.com"), (13, "b.org "), (18, "c.net"), (22, "t"), (25, "d.net")], [(line, r.name) for line, r in records])
+        assertEqual(expected, summary(pp.pwfile_from_records(records)))
+
+    # records are yielded before the whole file is read
+    f = io.StringIO(text)
+    records = pp.read_pwlist4(f, 16)
+    assertEqual(2, next(records)[0])
+    assertEqual(True, f.read(1) != "")
+
+    # errors are reported with their line in the file
+    warnings = []
+    warn = pp.warn
+    pp.warn = lambda fmt, *args: warnings.append(fmt % args)
+
+    try:
+        records = list(pp.read_pwlist4(io.StringIO(text + "\nx\n  bad\n"), 16))
+    finally:
+        pp.warn = warn
+
+    assertEqual(["domain name must end with : in line 27, column 1", "unexpected symbol ' ' in line 28, column 1"], warnings)
+    assertEqual(6, len(records))
+
+def domain_index_test():
+    pws = pp.parse_pwlist4(valid)
+
+    for i in range(100, 0, -1):
+        pws.add_user("d%03d.com" % i, "user%d" % i, "seq")
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        pp.save_pwlist4(path, pws, sort=True)
+        loaded = pp.load_pwlist4(path)
+        assertEqual(sorted(pws.domains.keys()), list(loaded.domains.keys()))
+        assertEqual(summary(loaded)[2], summary(pp.load_pwlist4_domain(path, "x"))[2])
+
+        for name in pws.domains.keys():
+            part = pp.load_pwlist4_domain(path, name)
+            assertEqual([d for d in summary(loaded)[1] if d[0] == name], summary(part)[1])
+            assertEqual("seq", part.default)
+
+        # before, between and after the domains
+        for name in ["", "a", "d050.co", "d050.comm", "z"]:
+            assertEqual([], list(pp.load_pwlist4_domain(path, name).domains.keys()))
+
+        # the index is only used for the file as it was saved
+        with open(path, "a") as f:
+            f.write("\ne.com:\n    x - seq\n")
+
+        assertEqual(None, pp.load_pwlist4_domain(path, "e.com"))
+
+        pp.save_pwlist4(path, pws, sort=False)
+        assertEqual(list(pws.domains.keys()), list(pp.load_pwlist4(path).domains.keys()))
+        assertEqual(None, pp.load_pwlist4_domain(path, "a.com"))
+
+def cache_test():
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return pp.load_pwlist4(path)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        cache_path = os.path.join(d, "pwlist4.cache")
+
+        text = valid.replace("    y - -z\n", "")
+
+        with open(path, "w") as f:
+            f.write(text)
+
+        pws, er = load_validated(path, load, cache_path)
+        assertEqual(None, er)
+        assertEqual(1, len(loads))
+
+        cached, er = load_validated(path, load, cache_path)
+        assertEqual(None, er)
+        assertEqual(1, len(loads))
+        assertEqual(summary(pws), summary(cached))
+        assertEqual("seq", cached.default)
+        assertEqual(["seq"], [s.name for s in cached.sequences.values() if s.default])
+
+        # same size and mtime, different contents
+        st = os.stat(path)
+
+        with open(path, "w") as f:
+            f.write(text.replace("alice", "alics"))
+
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        pws, er = load_validated(path, load, cache_path)
+        assertEqual(2, len(loads))
+        assertEqual(True, "alics" in pws.domains["a.com"].users)
+
+        # a broken cache is ignored and rewritten
+        with open(cache_path, "r+b") as f:
+            f.seek(-20, os.SEEK_END)
+            f.truncate()
+
+        load_validated(path, load, cache_path)
+        load_validated(path, load, cache_path)
+        assertEqual(3, len(loads))
+
+        # invalid files aren't cached
+        with open(path, "a") as f:
+            f.write("c.com:\n    x - unknown\n")
+
+        for i in range(2):
+            pws, er = load_validated(path, load, cache_path)
+            assertEqual("user x of domain c.com uses unknown sequence unknown", er)
+
+        assertEqual(5, len(loads))
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def journal_test():
+    pws = pp.parse_pwlist4(valid)
+    limit = pw.config.JOURNAL_LIMIT
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        journal = path + ".journal"
+        pp.save_pwlist4(path, pws)
+        data = read_bytes(path)
+        stat = source_stat(path)
+
+        # nothing changed, nothing is written
+        pws = pp.load_pwlist4(path)
+        assertEqual(False, pws.add_user("a.com", "alice", "seq"))
+        assertEqual(False, pp.save_changes(path, pws))
+        assertEqual(False, os.path.exists(journal))
+
+        # changes are appended to the journal and replayed
+        assertEqual(True, pws.add_user("a.com", "carol", "seq"))
+        assertEqual(True, pws.add_user("c.com", "dave", "LEGACY1"))
+        assertEqual(True, pp.save_changes(path, pws))
+        assertEqual([], pws.changes)
+        assertEqual(data, read_bytes(path))
+        assertEqual(True, os.path.exists(journal))
+        assertEqual(True, source_stat(path) != stat)
+        assertEqual(summary(pws), summary(pp.load_pwlist4(path)))
+        assertEqual([("c.com", [("dave", "LEGACY1")])], summary(pp.load_pwlist4_domain(path, "c.com"))[1])
+
+        # the end of an interrupted append is skipped
+        with open(journal, "a") as f:
+            f.write('["user", "e.com", "er')
+
+        warnings = []
+        warn = pw.journal.warn
+        pw.journal.warn = lambda fmt, *args: warnings.append(fmt % args)
+
+        try:
+            assertEqual(summary(pws), summary(pp.load_pwlist4(path)))
+            pws.add_user("e.com", "erin", "seq")
+            pp.save_changes(path, pws)
+            assertEqual(summary(pws), summary(pp.load_pwlist4(path)))
+            assertEqual(["ignoring broken change in line 3 of '%s'" % journal] * 2, warnings)
+
+            # compaction, also of partially loaded files
+            pw.config.JOURNAL_LIMIT = 0
+            part = pp.load_pwlist4_domain(path, "a.com")
+            part.add_user("a.com", "alice", "LEGACY1")
+            pws.add_user("a.com", "alice", "LEGACY1")
+            assertEqual(True, pp.save_changes(path, part))
+        finally:
+            pw.journal.warn = warn
+            pw.config.JOURNAL_LIMIT = limit
+
+        assertEqual(False, os.path.exists(journal))
+        assertEqual(summary(pws), summary(pp.load_pwlist4(path)))
+
+        # compaction keeps what other processes journaled since pws was loaded
+        other = pp.load_pwlist4(path)
+        other.add_user("f.com", "frank", "seq")
+        pp.save_changes(path, other)
+        pws.add_user("g.com", "grace", "seq")
+
+        try:
+            pw.config.JOURNAL_LIMIT = 0
+            pp.save_changes(path, pws)
+        finally:
+            pw.config.JOURNAL_LIMIT = limit
+
+        assertEqual(False, os.path.exists(journal))
+        domains = pp.load_pwlist4(path).domains
+        assertEqual(True, "f.com" in domains and "g.com" in domains)
+
+        # changes with names the parser refuses are skipped
+        with open(journal, "a") as f:
+            f.write('["user", "h:com", "heidi", "seq"]\n["user", "i.com", "ivan;", "seq"]\n["user", "j.com", "judy", "seq"]\n')
+
+        warnings = []
+        pw.journal.warn = lambda fmt, *args: warnings.append(fmt % args)
+
+        try:
+            loaded = pp.load_pwlist4(path)
+        finally:
+            pw.journal.warn = warn
+
+        assertEqual(2, len(warnings))
+
+        # the tail of the journal is read up to the last complete line
+        offset = os.path.getsize(journal)
+
+        with open(journal, "a") as f:
+            f.write('["user", "k.com", "ken", "seq"]\n["user", "l.com", "le')
+
+        changes, end = pw.journal.read_journal_tail(path, offset)
+        assertEqual([["user", "k.com", "ken", "seq"]], changes)
+        assertEqual(offset + len('["user", "k.com", "ken", "seq"]\n'), end)
+        assertEqual(([], end), pw.journal.read_journal_tail(path, end))
+        assertEqual(False, "forbidden" in (pp.validate_pwfile(loaded) or ""))
+        assertEqual(True, "j.com" in loaded.domains and "h:com" not in loaded.domains and "i.com" not in loaded.domains)
+
+def save_test():
+    pws = pp.parse_pwlist4(valid)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pwlist4")
+        pp.save_pwlist4(path, pws, sort=False)
+        data = read_bytes(path)
+        assertEqual(pp.pwlist4_header + pp.pwfile_to_string(pws), data.decode())
+        assertEqual(["pwlist4"], os.listdir(d))
+
+        # the mode is kept and symlinks are followed
+        os.chmod(path, 0o640)
+        link = os.path.join(d, "link")
+        os.symlink(path, link)
+        pws.add_user("c.com", "x", "seq")
+        pp.save_pwlist4(link, pws, sort=False)
+        assertEqual(True, os.path.islink(link))
+        assertEqual(0o640, os.stat(path).st_mode & 0o777)
+        assertEqual(summary(pws)[1], summary(pp.load_pwlist4(path))[1])
+
+        # a failed save leaves the file as it was
+        data = read_bytes(path)
+        pws.domains["d.com"] = pp.Domain(None)
+
+        try:
+            pp.save_pwlist4(path, pws)
+            raise AssertionError("saved an invalid domain")
+        except TypeError:
+            pass
+
+        assertEqual(data, read_bytes(path))
+        assertEqual(["link", "pwlist4"], sorted(os.listdir(d)))
+
+        # a save that runs while another one is writing doesn't share its
+        # temporary file
+        del pws.domains["d.com"]
+        other = pp.parse_pwlist4(valid)
+        other.add_user("e.com", "y", "seq")
+        write_pwlist4 = pp.write_pwlist4
+
+        def write_interrupted(f, pws, sort = False):
+            pp.write_pwlist4 = write_pwlist4
+            f.write(pp.pwlist4_header)
+            pp.save_pwlist4(path, other, sort=False)
+            f.write(pp.pwfile_to_string(pws))
+
+        pp.write_pwlist4 = write_interrupted
+
+        try:
+            pp.save_pwlist4(path, pws, sort=False)
+        finally:
+            pp.write_pwlist4 = write_pwlist4
+
+        assertEqual(pp.pwlist4_header + pp.pwfile_to_string(pws), read_bytes(path).decode())
+        assertEqual(["link", "pwlist4"], sorted(os.listdir(d)))
+
+def run_tests():
+    parse_test()
+    error_test()
+    read_test()
+    domain_index_test()
+    cache_test()
+    journal_test()
+    save_test()
+
+    print("%s: all tests passed" % __file__)
+
+if __name__ == "__main__":
+    run_tests()
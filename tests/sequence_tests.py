@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# sequence tests:
+# compiling and executing sequences
+
+import copy
+
+import pw.optimize as po
+import pw.sequence as ps
+import pw.transform as pt
+from pw.pwlist import Pwfile, Domain, User
+from pw.sequence import Sequence, Segment, Param
+
+def assertEqual(expected, actual):
+    if expected != actual:
+        raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
+
+def assertRaises(exc, f, *args):
+    try:
+        f(*args)
+    except exc:
+        return
+
+    raise AssertionError("assertion failed: %s not raised" % exc.__name__)
+
+def make_sequence(*segments):
+    seq = Sequence("test")
+
+    for func, params in segments:
+        seg = Segment(func)
+        seg.parameters = params
+        seq.segments.append(seg)
+
+    return seq
+
+def good_password():
+    return make_sequence(
+        ("init", [Param("field", "key"), Param("field", "domain"), Param("field", "user")]),
+        ("diceware", [Param("number", 4), Param("number", 4)]),
+        ("capitalize_some", []),
+        ("add_some_simple_special_characters", []))
+
+def compile_sequence_test():
+    seq = good_password()
+
+    plan = ps.compile_sequence(seq)
+    assertEqual(True, plan is ps.compile_sequence(seq))
+    assertEqual("Treat Go&p Tug 5th", plan("", "", ""))
+    assertEqual("Treat Go&p Tug 5th", ps.execute_sequence(seq, "", "", ""))
+
+    # changing the sequence invalidates the plan
+    seq.segments[1].parameters = [Param("number", 2), Param("number", 2)]
+    assertEqual(False, plan is ps.compile_sequence(seq))
+    assertEqual("treat* Gop", ps.execute_sequence(seq, "", "", ""))
+
+    seq.segments.append(Segment("limit"))
+    seq.segments[-1].parameters = [Param("number", 5)]
+    assertEqual("treat", ps.execute_sequence(seq, "", "", ""))
+
+    seq.segments.pop()
+    assertEqual("treat* Gop", ps.execute_sequence(seq, "", "", ""))
+
+    # so does changing a parameter in place
+    seq.segments[1].parameters[1].value = 4
+    assertEqual("Tr*eat gop tug", ps.execute_sequence(seq, "", "", ""))
+
+    # and any other edit of the segments or parameters
+    plan = ps.compile_sequence(seq)
+    seq.segments[1].parameters[0] = Param("number", 2)
+    assertEqual(False, plan is ps.compile_sequence(seq))
+
+    plan = ps.compile_sequence(seq)
+    seq.segments.insert(0, seq.segments.pop(2))
+    assertEqual(False, plan is ps.compile_sequence(seq))
+
+    # copies keep tracking their edits
+    copied = copy.deepcopy(seq)
+    assertEqual(ps.execute_sequence(seq, "", "", ""), ps.execute_sequence(copied, "", "", ""))
+    assertEqual(True, isinstance(copied.segments[-1].parameters, ps.EditList))
+    plan = ps.compile_sequence(copied)
+    copied.segments.pop()
+    assertEqual(False, plan is ps.compile_sequence(copied))
+
+def compile_errors_test():
+    assertRaises(ValueError, ps.compile_sequence, make_sequence(("nope", [])))
+    assertRaises(ValueError, ps.compile_sequence, make_sequence(("limit", [])))
+    assertRaises(ValueError, ps.compile_sequence, make_sequence(("append", [Param("field", "nope")])))
+
+def S(value):
+    return Param("string", value)
+
+def N(value):
+    return Param("number", value)
+
+def F(value):
+    return Param("field", value)
+
+def fusable_sequence():
+    return make_sequence(
+        ("init", [F("key"), F("domain"), F("user")]),
+        ("append", [S("x")]),
+        ("prepend", [N(7)]),
+        ("append", [F("user")]),
+        ("sha512", []),
+        ("base64", []),
+        ("cut", [N(3), N(60)]),
+        ("limit", [N(40)]),
+        ("cut", [N(-5), N(30)]),
+        ("replace", [S("+"), S("E")]),
+        ("replace", [S("/"), S("a")]),
+        ("replace", [S("a"), S("bb")]),
+        ("replace", [S("b"), S("")]),
+        ("replace", [S("E"), S("vv")]),
+        ("replace", [S("vv"), S("w")]),
+        ("replace", [S("1"), S("0")]),
+        ("prepend", [S("<")]),
+        ("append", [S(">")]))
+
+def optimize_test():
+    seq = fusable_sequence()
+    plan = ps.compile_sequence(seq, False)
+    optimized = ps.compile_sequence(seq, True)
+
+    assertEqual(18, len(plan.steps))
+    assertEqual(8, len(optimized.steps))
+
+    for key, domain, user in [("", "", ""), ("key", "example.com", "user"), ("ÄÖÜ", "€", " ")]:
+        assertEqual(plan(key, domain, user), optimized(key, domain, user))
+
+    assertEqual(True, po.verify_plans(plan, optimized, 500))
+
+    # single generations aren't optimized, bulk ones are
+    assertEqual(18, len(ps.compile_sequence(seq).steps))
+    pws = Pwfile()
+    pws.sequences[seq.name] = seq
+    list(ps.generate_many(pws, "key", [("a.com", "alice")], sequence=seq.name))
+    assertEqual(8, len(seq._plan.steps))
+
+    # replace on bytes fails the same way optimized or not
+    seq = make_sequence(("sha256", []), ("replace", [S("a"), S("b")]), ("replace", [S("c"), S("d")]))
+    assertRaises(TypeError, ps.compile_sequence(seq, True), "", "", "")
+    assertEqual(2, len(ps.compile_sequence(seq, True).steps))
+
+def cut_fusion_test():
+    bounds = [-3, 0, 1, 2, 5, 9, 30]
+    s = "abcdefghijklmnopqrstuvwxyz"
+
+    for b1 in bounds:
+        for e1 in bounds:
+            for b2 in bounds:
+                for e2 in bounds:
+                    seq = make_sequence(("append", [S(s)]), ("cut", [N(b1), N(e1)]), ("cut", [N(b2), N(e2)]))
+                    plan = ps.compile_sequence(seq, False)
+                    step = po.fuse_cuts(plan.steps[1:])
+                    assertEqual(plan("", "", ""), step[0](s, *step[1]))
+
+def verify_rejects_test():
+    seq = fusable_sequence()
+    plan = ps.compile_sequence(seq, False)
+    broken = ps.SequencePlan(plan.steps[:-1])
+    assertEqual(False, po.verify_plans(plan, broken))
+
+    # a wrong fusion must never make it into a compiled plan
+    fusions = po.fusions
+    po.fusions = [(lambda step: step[0].__name__ == "append", lambda steps: steps[0])]
+
+    try:
+        optimized = ps.compile_sequence(seq, True)
+        assertEqual(18, len(optimized.steps))
+    finally:
+        po.fusions = fusions
+
+def value_representation_test():
+    seq = make_sequence(
+        ("init", [F("key"), F("domain"), F("user")]),
+        ("sha512", []),
+        ("base64", []),
+        ("sha256", []),
+        ("base58", []))
+
+    plan = ps.compile_sequence(seq)
+    funcs = [step[0] for step in plan.steps]
+    assertEqual([pt.init, pt.sha512, pt.base64_bytes, pt.sha256_bytes, pt.base58_bytes], funcs)
+    assertEqual("bytes", plan.gives)
+
+    expected = pt.base58(pt.sha256(pt.base64(pt.sha512(pt.init("", "k", "d", "u"))))).decode()
+    assertEqual(expected, plan("k", "d", "u"))
+
+    # natives are only used where the input is known to be bytes
+    seq = make_sequence(("seed", [N(0), N(100)]), ("sha256", []), ("to_int", []))
+    plan = ps.compile_sequence(seq)
+    assertEqual([pt.seed, pt.sha256, pt.to_int_bytes], [step[0] for step in plan.steps])
+    assertEqual("int", plan.gives)
+
+    seq = make_sequence(("init", [F("key"), F("domain"), F("user")]), ("limit", [N(3)]))
+    assertEqual("str", ps.compile_sequence(seq).gives)
+
+def make_pwfile():
+    pws = Pwfile()
+    pws.sequences["good"] = good_password()
+    pws.sequences["good"].name = "good"
+    pws.default = "good"
+    
+    pws.domains["a.com"] = Domain("a.com")
+    pws.domains["a.com"].users["alice"] = User("alice", "LEGACY2")
+    pws.domains["a.com"].users["bob"] = User("bob", "good")
+    
+    return pws
+
+def generate_many_test():
+    pws = make_pwfile()
+    pairs = [("a.com", "alice"), ("a.com", "bob"), ("a.com", "carol"), ("b.com", "alice")]
+    pairs += [("d%d.com" % i, "user") for i in range(40)]
+    
+    expected = []
+    
+    for domain, user in pairs:
+        seq = pws.get_sequence(pws.get_sequence_name(domain, user))
+        expected.append((domain, user, ps.execute_sequence(seq, "key", domain, user)))
+    
+    assertEqual(pt.bad_legacy2("", "key", "a.com", "alice"), expected[0][2])
+    
+    for backend in ["inline", "thread", "process"]:
+        actual = list(ps.generate_many(pws, "key", iter(pairs), backend, workers=2, chunksize=3))
+        assertEqual(expected, actual)
+    
+    actual = list(ps.generate_many(pws, "key", pairs[:2], sequence="LEGACY1"))
+    assertEqual([pt.bad_legacy1("", "key", domain) for domain, user in pairs[:2]], [pw for d, u, pw in actual])
+    
+    assertRaises(ValueError, list, ps.generate_many(pws, "key", pairs, "nope"))
+    assertRaises(ValueError, list, ps.generate_many(pws, "key", pairs, sequence="nope"))
+
+def run_tests():
+    compile_sequence_test()
+    compile_errors_test()
+    optimize_test()
+    cut_fusion_test()
+    verify_rejects_test()
+    value_representation_test()
+    generate_many_test()
+
+    print("%s: all tests passed" % __file__)
+
+if __name__ == "__main__":
+    run_tests()
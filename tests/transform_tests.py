@@ -2,17 +2,53 @@
 # transform tests:
 # use these as a reference for implementing pw
 
+import os
+import random
+import tempfile
+import threading
+
+import pw.config
 import pw.transform as pt
+import pw.batch as pb
+import pw.b58 as b58
+import pw.wordlist as pwl
+import pw.wordlists as pwls
 
 def assertEqual(expected, actual):
     if expected != actual:
         raise AssertionError("assertion failed: %s == %s" % (repr(expected), repr(actual)))
 
+def assertRaises(exc, f, *args):
+    try:
+        f(*args)
+    except exc:
+        return
+
+    raise AssertionError("assertion failed: %s not raised" % exc.__name__)
+
 def to_int_test():
     assertEqual(0, pt.to_int(""))
     assertEqual(6513249, pt.to_int("abc"))
     assertEqual(3291835376408573590478209986637364656599265025014012802863049622424083630783948306431999498413285667939592978357630573418285899181951386474024455144309711, pt.to_int(pt.sha512("")))
 
+def base58_test():
+    assertEqual(b"", pt.base58(""))
+    assertEqual(b"1", pt.base58(b"\0"))
+    assertEqual(b"11ZiCa", pt.base58(b"\0\0abc"))
+    assertEqual(b"StV1DL6CwTryKyV", pt.base58("hello world"))
+    assertEqual(b"DYu3G8aGTMBW1WrTw76zxQJQU4DHLw9MLyy7peG4LKkY", pt.base58(pt.sha256("abc")))
+
+    rng = random.Random(0)
+
+    for n in [1, 4, 5, 31, 32, 33, 64, 500, 4096]:
+        b = bytes(rng.randrange(256) for i in range(n))
+        assertEqual(b, b58.b58decode(b58.b58encode(b)))
+        assertEqual(b"\0" + b, b58.b58decode(b58.b58encode(b"\0" + b)))
+
+    assertEqual(b"StV1DL6CwTryKyV", b58.b58encode(bytearray(b"hello world")))
+    assertRaises(TypeError, pt.base58, 5)
+    assertRaises(TypeError, b58.b58encode, None)
+
 def seed_test():
     assertEqual(0, pt.seed(0, 0, 0))
     assertEqual(1, pt.seed(0, 0, 1))
@@ -29,6 +65,135 @@ def seed_test():
     assertEqual(46370, pt.seed("hello", 0, 65535))
     assertEqual(53137, pt.seed("hello world", 0, 65535))
 
+def seed_cache_test():
+    pt.seed_cache.clear()
+    a = pt.seed("hello world", 0, 65535)
+    b = pt.seed("hello world", 0, 65535)
+    assertEqual(53137, a)
+    assertEqual(53137, b)
+    assertEqual(1, pt.seed_cache.hits)
+    assertEqual(1, pt.seed_cache.misses)
+
+    # different ranges are different entries
+    assertEqual(59569, pt.seed("", 0, 65535))
+    assertEqual(0, pt.seed("", 0, 0))
+    assertEqual(3, pt.seed_cache.misses)
+
+    # raw inputs must never end up in the cache
+    for key in pt.seed_cache._entries.keys():
+        assertEqual(False, b"hello world" in key[1])
+
+    # str, bytes and int inputs with cache disabled give the same results
+    inputs = [0, 1, 12345, 2**300, "", "abc", b"abc", pt.sha256("abc")]
+    cached = [pt.seed(s, 0, 1000) for s in inputs]
+    cached_again = [pt.seed(s, 0, 1000) for s in inputs]
+    pt.seed_cache.resize(2)
+    assertEqual(2, len(pt.seed_cache))
+    pt.seed_cache.resize(0)
+    uncached = [pt.seed(s, 0, 1000) for s in inputs]
+    assertEqual(0, len(pt.seed_cache))
+    pt.seed_cache.resize(pw.config.SEED_CACHE_SIZE)
+
+    assertEqual(uncached, cached)
+    assertEqual(uncached, cached_again)
+
+    pt.seed_cache.clear()
+    assertEqual(0, len(pt.seed_cache))
+    assertEqual(0, pt.seed_cache.hits)
+
+def seed_many_test():
+    inputs = [0, 1, 2**200, -5, 1.5, "", "abc", b"abc", "x" * 3000]
+    inputs += ["input %d" % i for i in range(500)]
+    inputs += [pt.sha256(str(i)) for i in range(500)]
+
+    ranges = [(0, 0), (0, 1), (0, 3), (0, 65535), (-10, 10), (0, 2**32-1), (5, 2**40), (0, 2**70)]
+
+    for a, b in ranges:
+        assertEqual([random.Random(s).randint(a, b) for s in inputs], pb.seed_many(inputs, a, b))
+
+    assertEqual([], pb.seed_many([], 0, 1))
+
+def wordlist_test():
+    words = pwl.read_words(pwl.source_path)
+    wl = pwl.wordlist
+
+    # the packed list must match its source, in order
+    assertEqual(words, list(wl))
+    assertEqual(7701, len(wl))
+    assertEqual("a", wl[0])
+    assertEqual("9th", wl[-1])
+    assertEqual(words[100:103], wl[100:103])
+    assertEqual(pwl.pack_words(words), open(pwl.packed_path, "rb").read())
+
+    try:
+        wl[len(wl)]
+        raise AssertionError("no IndexError")
+    except IndexError:
+        pass
+
+def write_wordlist(path, words):
+    with open(path, "w") as f:
+        f.write("# test list\n" + "\n".join(words) + "\n")
+
+def wordlists_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "small.txt")
+        words = ["w%d" % i for i in range(1000)]
+        write_wordlist(path, words)
+        write_wordlist(os.path.join(d, "other.txt"), ["x", "y"])
+        pwls.register_wordlist_dir(d)
+
+        assertEqual(True, "small" in pwls.registered_wordlists())
+        assertEqual(True, "other" in pwls.registered_wordlists())
+        assertEqual(pt.diceware_list("abc", 3, 5, words), pt.diceware_file("abc", "small", 3, 5))
+
+        # loaded once while the file doesn't change
+        wl = pwls.get_wordlist("small")
+        assertEqual(True, wl is pwls.get_wordlist("small"))
+        assertEqual(words, list(wl))
+
+        # pinned by fingerprint
+        fingerprint = pwls.wordlist_fingerprint("small")
+        assertEqual(True, wl is pwls.get_wordlist("small@" + fingerprint))
+        assertEqual(True, wl is pwls.get_wordlist("small@" + fingerprint[:8]))
+        assertRaises(ValueError, pwls.get_wordlist, "small@" + pwls.wordlist_fingerprint("other"))
+        assertRaises(ValueError, pwls.get_wordlist, "small@")
+
+        # reloaded when the file changes
+        words.reverse()
+        write_wordlist(path, words)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assertEqual(words, list(pwls.get_wordlist("small")))
+        assertEqual(False, fingerprint == pwls.wordlist_fingerprint("small"))
+        assertRaises(ValueError, pwls.get_wordlist, "small@" + fingerprint)
+
+        # the fingerprint doesn't depend on the file, only on the words
+        copy = os.path.join(d, "copy")
+        with open(copy, "w") as f:
+            f.write("\n".join(words))
+        pwls.register_wordlist("copy", copy)
+        assertEqual(pwls.wordlist_fingerprint("small"), pwls.wordlist_fingerprint("copy"))
+
+        # invalid lists
+        for name, bad in [("one", ["a"]), ("dup", ["a", "b", "a"]), ("space", ["a", "b c"])]:
+            write_wordlist(os.path.join(d, name), bad)
+            pwls.register_wordlist(name, os.path.join(d, name))
+            assertRaises(ValueError, pwls.get_wordlist, name)
+
+        assertRaises(ValueError, pwls.get_wordlist, "unknown")
+        assertRaises(ValueError, pwls.register_wordlist, "a@b", path)
+
+def diceware_many_test():
+    inputs = ["", "abc", "hello", "hello world", "aspen spoon 567 scrap"]
+    inputs += ["account%d:user@domain" % i for i in range(300)]
+
+    for a, b in [(1, 4), (4, 4), (0, 2)]:
+        assertEqual([pt.diceware(s, a, b) for s in inputs], pb.diceware_many(inputs, a, b))
+
+    words = ["a", "b", "c"]
+    assertEqual([pt.diceware_list(s, 2, 5, words) for s in inputs], pb.diceware_many(inputs, 2, 5, words))
+
 def append_test():
     assertEqual("", pt.append("", ""))
     assertEqual("a", pt.append("a", ""))
@@ -93,6 +258,12 @@ def add_special_characters_test():
     assertEqual("h#ello world", pt.add_some_simple_special_characters("hello world"))
     assertEqual("aspen spoon 567# scrap", pt.add_some_simple_special_characters("aspen spoon 567 scrap"))
 
+    # many insertions, including next to each other and non-ascii text
+    assertEqual("s_olo_n co.ugh_ vi[gil +me%w sp:i?ro k#ee_l dow= cu?rd# a]jax t&oss# gules", pt.add_special_characters("solon cough vigil mew spiro keel dow curd ajax toss gules", 10, 20, "#+*%&[]=?_.:"))
+    assertEqual("gür§üßäe öaus üköölnä,ü çaä§ v§a? üñaöndäú", pt.add_special_characters("grüße aus köln, ça va? ñandú", 5, 15, "äöü§"))
+    assertEqual("1ab9c71de8f05gh99i0jk57l8mn7o38p1qr9s27tu9v67wx59yz9", pt.add_special_characters("abcdefghijklmnopqrstuvwxyz", 26, 26, "0123456789"))
+    assertEqual("#x", pt.add_special_characters("x", 0, 5, "#"))
+
 def capitalize_some_test():
     assertEqual("", pt.capitalize_some(""))
     assertEqual("Abc", pt.capitalize_some("abc"))
@@ -113,9 +284,35 @@ def diceware_test():
     assertEqual("aspen spoon 567 scrap", pt.diceware("hello world", 4, 4))
     assertEqual("ajax toss gules filch", pt.diceware("aspen spoon 567 scrap", 4, 4))
 
+def thread_safety_test():
+    inputs = ["hello world", "aspen spoon 567 scrap", "solon cough vigil mew", "spiro keel dow curd"]
+    expected = [pt.capitalize_some(s) for s in inputs]
+    errors = []
+
+    def worker():
+        for _ in range(200):
+            for s, e in zip(inputs, expected):
+                # interleave global seeding to make sure transforms don't depend on it
+                pt.random.seed(0)
+                if pt.capitalize_some(s) != e:
+                    errors.append(s)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    assertEqual([], errors)
+
 def run_tests():
     to_int_test()
+    base58_test()
     seed_test()
+    seed_cache_test()
+    seed_many_test()
     append_test()
     prepend_test()
     cut_test()
@@ -126,6 +323,10 @@ def run_tests():
     add_special_characters_test()
     capitalize_some_test()
     diceware_test()
+    wordlist_test()
+    wordlists_test()
+    diceware_many_test()
+    thread_safety_test()
 
     print("%s: all tests passed" % __file__)
 